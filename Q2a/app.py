@@ -1,27 +1,36 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, abort
 import books
+from catalog import Catalog
 
 app = Flask(__name__)
+app.config.from_object('config')
+
+# Built once into a compact record store; request handlers only read from it
+catalog = Catalog(books.all_books)
 
 @app.route('/')
 def index():
     # Get the category from the request args (if any)
     category = request.args.get('category', None)
-    if category:
-        filtered_books = [book for book in books.all_books if category in book['category']]
-    else:
-        filtered_books = books.all_books
+    page = request.args.get('page', 1, type=int)
+    per_page = app.config['PER_PAGE']
 
-    # Sort books by title
-    filtered_books.sort(key=lambda x: x['title'])
+    # Views are pre-sorted by title, so this is just a slice
+    total = len(catalog.books_in(category))
+    pages = max(1, -(-total // per_page))
+    page = min(max(page, 1), pages)
+    page_books, total = catalog.page(category, page=page, per_page=per_page)
 
-    return render_template('index.html', books=filtered_books, category=category)
+    return render_template('index.html', books=page_books, total=total, category=category,
+                           page=page, pages=pages)
 
 @app.route('/book/<int:book_id>')
 def book_details(book_id):
-    book = books.all_books[book_id]
+    book = catalog.get(book_id)
+    if book is None:
+        abort(404)
 
     return render_template('book_details.html', book=book, panel='BOOK DETAILS')
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,2 @@
+# Number of books shown per catalog page
+PER_PAGE = 20
@@ -0,0 +1,192 @@
+"""Compact, array-backed record store for the in-memory book catalog.
+
+Each book in books.py is a dict holding three nested lists, which costs several
+hundred bytes per record before any text is counted. Here the fields are kept
+in parallel columns instead:
+
+  - numbers live in `array` columns (4 bytes each),
+  - category is a 1-byte index into an interned vocabulary,
+  - genres are a bitmask over an interned genre vocabulary,
+  - author lists are interned tuples shared between books by the same authors,
+  - paragraphs are stored as a tuple of strings.
+
+A book's id is its position at load time and never changes afterwards.
+`store.get(book_id)` returns a lightweight `BookRecord` view with the same
+attribute names the templates use (title, authors, category, ...).
+"""
+
+import sys
+from array import array
+
+
+class BookRecord:
+    """Read-only view of one row in a RecordStore."""
+
+    __slots__ = ('_store', 'id')
+
+    def __init__(self, store, book_id):
+        self._store = store
+        self.id = book_id
+
+    @property
+    def title(self):
+        return self._store._titles[self.id]
+
+    @property
+    def url(self):
+        return self._store._urls[self.id]
+
+    @property
+    def category(self):
+        return self._store._categories[self._store._category_idx[self.id]]
+
+    @property
+    def genres(self):
+        mask = self._store._genre_masks[self.id]
+        return [g for bit, g in enumerate(self._store._genres) if mask >> bit & 1]
+
+    @property
+    def authors(self):
+        return self._store._authors[self.id]
+
+    @property
+    def description(self):
+        return self._store._descriptions[self.id]
+
+    @property
+    def pages(self):
+        return self._store._pages[self.id]
+
+    @property
+    def available(self):
+        return self._store._available[self.id]
+
+    @property
+    def copies(self):
+        return self._store._copies[self.id]
+
+    def __repr__(self):
+        return f"<BookRecord {self.id}: {self.title!r}>"
+
+
+class RecordStore:
+    def __init__(self, raw_books=()):
+        self._titles = []
+        self._urls = []
+        self._descriptions = []
+        self._authors = []
+        self._category_idx = array('B')
+        self._genre_masks = array('I')
+        self._pages = array('i')
+        self._available = array('i')
+        self._copies = array('i')
+
+        # Interned vocabularies
+        self._categories = []
+        self._category_lookup = {}
+        self._genres = []
+        self._genre_lookup = {}
+        self._author_tuples = {}
+
+        for book in raw_books:
+            self.add(book)
+
+    def __len__(self):
+        return len(self._titles)
+
+    def __iter__(self):
+        return (BookRecord(self, i) for i in range(len(self)))
+
+    def get(self, book_id: int):
+        """Return the record with this id, or None."""
+        if 0 <= book_id < len(self):
+            return BookRecord(self, book_id)
+        return None
+
+    def _category_index(self, category: str) -> int:
+        idx = self._category_lookup.get(category)
+        if idx is None:
+            if len(self._categories) >= 256:
+                raise ValueError("Too many distinct categories for a 1-byte index.")
+            idx = self._category_lookup[category] = len(self._categories)
+            self._categories.append(sys.intern(category))
+        return idx
+
+    def _genre_mask(self, genres) -> int:
+        mask = 0
+        for genre in genres:
+            bit = self._genre_lookup.get(genre)
+            if bit is None:
+                if len(self._genres) >= self._genre_masks.itemsize * 8:
+                    raise ValueError("Too many distinct genres for the genre bitmask.")
+                bit = self._genre_lookup[genre] = len(self._genres)
+                self._genres.append(sys.intern(genre))
+            mask |= 1 << bit
+        return mask
+
+    def _intern_authors(self, authors) -> tuple:
+        key = tuple(sys.intern(a) for a in authors)
+        return self._author_tuples.setdefault(key, key)
+
+    def add(self, book: dict) -> int:
+        """Append a book in the books.py dict format and return its id."""
+        desc = book.get('description') or ()
+        if isinstance(desc, str):
+            desc = (desc,)
+        self._titles.append(book['title'])
+        self._urls.append(book.get('url'))
+        self._descriptions.append(tuple(desc))
+        self._authors.append(self._intern_authors(book.get('authors', ())))
+        self._category_idx.append(self._category_index(book.get('category') or ''))
+        self._genre_masks.append(self._genre_mask(book.get('genres', ())))
+        self._pages.append(book.get('pages') or 0)
+        self._available.append(book.get('available') or 0)
+        self._copies.append(book.get('copies') or 0)
+        return len(self._titles) - 1
+
+    # -------------------- Memory Reporting --------------------
+    def bytes_per_record(self) -> float:
+        """Approximate container overhead per record, excluding string payloads."""
+        n = len(self)
+        if not n:
+            return 0.0
+        total = sum(sys.getsizeof(col) for col in (
+            self._titles, self._urls, self._descriptions, self._authors,
+            self._category_idx, self._genre_masks, self._pages, self._available, self._copies,
+        ))
+        total += sum(sys.getsizeof(d) for d in self._descriptions)
+        total += sum(sys.getsizeof(a) for a in self._author_tuples)
+        return total / n
+
+
+def dict_bytes_per_record(raw_books) -> float:
+    """Same measurement as RecordStore.bytes_per_record for the plain dict form."""
+    if not raw_books:
+        return 0.0
+    total = sys.getsizeof(raw_books)
+    for book in raw_books:
+        total += sys.getsizeof(book)
+        total += sum(sys.getsizeof(v) for v in book.values() if isinstance(v, (list, tuple)))
+        total += sum(sys.getsizeof(v) for v in book.values() if isinstance(v, int))
+    return total / len(raw_books)
+
+
+if __name__ == '__main__':
+    # Memory comparison against the dict form: python records.py [count]
+    import books
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # Copy the sample rows so every record owns its containers, as a real load would
+    raw = [
+        {k: (list(v) if isinstance(v, list) else v) for k, v in books.all_books[i % len(books.all_books)].items()}
+        for i in range(count)
+    ]
+    for i, book in enumerate(raw):
+        book['pages'] = 1000 + i  # defeat the small-int cache like real data would
+    store = RecordStore(raw)
+    as_dict = dict_bytes_per_record(raw)
+    as_store = store.bytes_per_record()
+    print(f"{count:,} books")
+    print(f"dict form:    {as_dict:8.1f} bytes/record")
+    print(f"record store: {as_store:8.1f} bytes/record")
+    print(f"reduction:    {as_dict / as_store:8.2f}x")
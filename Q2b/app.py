@@ -1,21 +1,218 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+import os
+import threading
+from datetime import datetime
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, g, send_file, jsonify
 from flask_mongoengine import MongoEngine
-from model import Book, User, seed_users, Loan
+import click
+from model import Book, User, seed_users, Loan, reconcile_loan_counters, compress_descriptions, books_storage_report
+from covers import CoverCache, CoverFetchError
+from replica import CatalogReplica
+from ratelimit import RateLimiter
+from passwords import hasher, HasherBusy
+from events import availability
+from audit import audit
+from fragments import FragmentCache
+from compress import Compressor
+from readprefs import ReadRouter
+from singleflight import Group, FlightTimeout
+import views
+import rollups
+import export
+from similar import SimilarityIndex
+from suggest import SuggestIndex
+from jinja2 import FileSystemBytecodeCache
+import metrics
 from bson import ObjectId  # if needed, often not required directly
-from mongoengine import DoesNotExist
+from mongoengine import DoesNotExist, ValidationError
+from mongoengine.connection import get_db
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dev-secret-key'
 app.config['MONGODB_SETTINGS'] = {
     'db': 'ict_239_library',
-    'host': 'localhost',
+    # Or a replica set URI, e.g. mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+    'host': os.environ.get('MONGODB_HOST', 'localhost'),
     'port': 27017
 }
+# Where each class of read goes (see readprefs.py); writes always go to the primary
+app.config['READ_PREFERENCES'] = {
+    'catalog': ('secondaryPreferred', 90),  # book lists, details, covers, type-ahead
+    'reports': ('secondaryPreferred', 90),  # admin rollups
+    'account': 'primary',                   # the signed-in user
+    'loans': 'primary',                     # a member's own loans
+}
+app.config['READ_YOUR_WRITES_SECONDS'] = 10  # all reads go to the primary this long after a change
+# Concurrent identical catalog loads share one query (see singleflight.py); waiters past this get a 503
+app.config['SINGLE_FLIGHT_TIMEOUT'] = 10.0
+# Local thumbnail cache for book covers (see covers.py)
+app.config['COVER_CACHE_DIR'] = os.path.join(app.instance_path, 'covers')
+app.config['COVER_THUMB_WIDTH'] = 300   # 2x the 150px card width
+app.config['COVER_MAX_AGE'] = 60 * 60 * 24 * 365
+app.config['COVER_PREFETCH_ON_START'] = True
+app.config['COVER_FAILURE_TTL'] = 300  # seconds to stop retrying an unreachable cover
+app.config['COVER_PREFETCH_MAX_PENDING'] = 256  # downloads queued at once by the startup walk
+# Optional in-memory copy of the books collection for catalog reads (see replica.py)
+app.config['CATALOG_REPLICA'] = False
+app.config['CATALOG_REPLICA_POLL_SECONDS'] = 2.0
+app.config['CATALOG_REPLICA_MAX_STALENESS'] = 10.0
+app.config['CATALOG_REPLICA_POLL_OVERLAP'] = 5.0
+app.config['CATALOG_REPLICA_RECONCILE_SECONDS'] = 60.0  # polling only: how often deleted books are found
+# Token buckets per user and endpoint: (burst capacity, refill tokens per second)
+app.config['RATE_LIMITS'] = {
+    'create_loan': (5, 0.5),
+    'renew_loan': (5, 0.5),
+    'return_loan': (5, 0.5),
+    'delete_loan': (10, 1.0),
+}
+# Cached catalog card fragments and compiled templates (see fragments.py)
+app.config['FRAGMENT_CACHE_SIZE'] = 5000
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja_cache')
+# Password hashing cost and pool size (see passwords.py)
+app.config['PASSWORD_HASH_ITERATIONS'] = 600_000
+app.config['PASSWORD_HASH_WORKERS'] = 2
+app.config['PASSWORD_HASH_MAX_PENDING'] = 16
+# Loan audit trail, written in batches by a background thread (see audit.py)
+app.config['AUDIT_LOG'] = True
+app.config['AUDIT_QUEUE_SIZE'] = 10_000
+app.config['AUDIT_BATCH_SIZE'] = 500
+app.config['AUDIT_FLUSH_SECONDS'] = 1.0
+app.config['AUDIT_OVERFLOW'] = 'drop_new'  # or 'drop_oldest' / 'block'
+app.config['AUDIT_RETRIES'] = 3             # per failed batch, waiting 0.1s, 0.2s, 0.4s
+app.config['AUDIT_RETRY_BACKOFF'] = 0.1
+# Live availability streams (see events.py). Each open stream holds a worker thread,
+# so keep the limit well below the thread count unless running under gevent.
+# Pages over the limit get a 503 and their script retries with backoff.
+app.config['AVAILABILITY_MAX_SUBSCRIBERS'] = 16
+app.config['AVAILABILITY_HEARTBEAT_SECONDS'] = 15.0
+# gzip (and brotli, if installed) for text responses (see compress.py)
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+
+hasher.configure(iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+                 workers=app.config['PASSWORD_HASH_WORKERS'],
+                 max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
+
+availability.configure(max_subscribers=app.config['AVAILABILITY_MAX_SUBSCRIBERS'],
+                       heartbeat=app.config['AVAILABILITY_HEARTBEAT_SECONDS'])
 
 db = MongoEngine(app)
 
+if app.config['AUDIT_LOG']:
+    audit.configure(sink=lambda docs: get_db()['audit_log'].insert_many(docs, ordered=False),
+                    max_queue=app.config['AUDIT_QUEUE_SIZE'],
+                    batch_size=app.config['AUDIT_BATCH_SIZE'],
+                    flush_interval=app.config['AUDIT_FLUSH_SECONDS'],
+                    overflow=app.config['AUDIT_OVERFLOW'],
+                    retries=app.config['AUDIT_RETRIES'],
+                    retry_backoff=app.config['AUDIT_RETRY_BACKOFF'])
+
+cover_cache = CoverCache(app.config['COVER_CACHE_DIR'], width=app.config['COVER_THUMB_WIDTH'],
+                         failure_ttl=app.config['COVER_FAILURE_TTL'],
+                         max_pending=app.config['COVER_PREFETCH_MAX_PENDING'])
+
 Book.init_db()  # Initialize the database with book data
 seed_users()    # Seed default users
+if app.config['COVER_PREFETCH_ON_START']:
+    # Walks the catalog in 1000-book batches on a background thread, in one worker process only
+    cover_cache.prefetch_all(lambda: (son.get('url') for son in
+                                      Book.objects.only('url').as_pymongo().batch_size(1000)))
+
+catalog_replica = None
+if app.config['CATALOG_REPLICA']:
+    catalog_replica = CatalogReplica(Book,
+                                     poll_interval=app.config['CATALOG_REPLICA_POLL_SECONDS'],
+                                     max_staleness=app.config['CATALOG_REPLICA_MAX_STALENESS'],
+                                     poll_overlap=app.config['CATALOG_REPLICA_POLL_OVERLAP'],
+                                     reconcile_interval=app.config['CATALOG_REPLICA_RECONCILE_SECONDS'])
+    catalog_replica.start()
+    metrics.register('catalog_replica', catalog_replica.metrics)
+
+rate_limiter = RateLimiter(app.config['RATE_LIMITS'])
+metrics.register('rate_limiter', rate_limiter.metrics)
+metrics.register('password_hasher', hasher.metrics)
+metrics.register('availability_events', availability.metrics)
+metrics.register('audit_log', audit.metrics)
+
+compressor = Compressor()
+compressor.init_app(app)
+metrics.register('compression', compressor.metrics)
+
+reads = ReadRouter(app.config['READ_PREFERENCES'], pin_seconds=app.config['READ_YOUR_WRITES_SECONDS'])
+metrics.register('read_preferences', reads.metrics)
+
+flights = Group()
+metrics.register('single_flight', flights.metrics)
+
+def coalesced(key, fn):
+    """Run fn once for concurrent callers with the same key.
+
+    A caller that waits longer than SINGLE_FLIGHT_TIMEOUT gets a 503 (see below). Running fn
+    itself instead would bring the stampede back exactly when the database is slowest.
+    """
+    return flights.do(key, fn, timeout=app.config['SINGLE_FLIGHT_TIMEOUT'])
+
+@app.errorhandler(FlightTimeout)
+def flight_timeout(e):
+    return "The server is busy. Please try again in a moment.", 503, {'Retry-After': '5'}
+
+# Indexes too slow to build inside a request are built on a background thread, one per name
+_index_builds = {}
+_index_builds_lock = threading.Lock()
+
+def build_in_background(name, fn):
+    with _index_builds_lock:
+        thread = _index_builds.get(name)
+        if thread is None or not thread.is_alive():  # a failed build is retried by the next request
+            thread = _index_builds[name] = threading.Thread(target=fn, name=f'build-{name}', daemon=True)
+            thread.start()
+
+# Compiled templates survive worker restarts; must be set before the first template loads
+os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+fragment_cache = FragmentCache(app.jinja_env, max_entries=app.config['FRAGMENT_CACHE_SIZE'])
+app.jinja_env.globals['card_fragment'] = fragment_cache.render
+metrics.register('fragment_cache', fragment_cache.metrics)
+
+# Built in the background on first use from the books collection, then kept current by new_book
+# (books created during the build are replayed into it). Until it is ready, detail pages render
+# without similar books.
+similar_index = SimilarityIndex(Book.GENRES, k=5)
+metrics.register('similar_books', similar_index.metrics)
+
+def build_similar_index():
+    if not similar_index.built:
+        similar_index.build(reads.queryset(Book.objects, 'catalog')
+                            .only('id', 'title', 'genres', 'category', 'authors').as_pymongo())
+
+def similar_books(book):
+    if not similar_index.built:
+        build_in_background('similar_index', build_similar_index)
+        return []
+    return similar_index.similar(book.id)
+
+# Title/author type-ahead, also built in the background on first use (see suggest.py);
+# it suggests nothing until then
+suggest_index = SuggestIndex()
+metrics.register('suggest', suggest_index.metrics)
+
+def ensure_suggest_index() -> bool:
+    if not suggest_index.built:
+        build_in_background('suggest_index', build_suggest_index)
+    return suggest_index.built
+
+def build_suggest_index():
+    if not suggest_index.built:
+        suggest_index.start_build()  # loans made from here on are replayed into the new index
+        try:
+            loan_counts = {row['_id']: row['n'] for row in
+                           reads.collection(Loan._get_collection(), 'reports')
+                           .aggregate([{'$group': {'_id': '$book', 'n': {'$sum': 1}}}])}
+        except BaseException:
+            suggest_index.cancel_build()
+            raise
+        suggest_index.build(reads.queryset(Book.objects, 'catalog').only('id', 'title', 'authors').as_pymongo(),
+                            loan_counts)
 
 # -------------------- Auth / Role Helpers --------------------
 from functools import wraps
@@ -41,13 +238,24 @@ def admin_required(f):
         return f(*args, **kwargs)
     return wrapper
 
+@app.before_request
+def enforce_rate_limits():
+    # Registered before load_current_user so rejected requests never touch the database
+    if request.method != 'POST' or not rate_limiter.limits(request.endpoint):
+        return None
+    client = session.get('user_id') or request.remote_addr or 'anonymous'
+    wait = rate_limiter.hit(request.endpoint, client)
+    if wait:
+        return "Too many requests. Please slow down.", 429, {'Retry-After': str(max(1, int(wait + 0.999)))}
+    return None
+
 @app.before_request
 def load_current_user():
     g.current_user = None
     uid = session.get('user_id')
     if uid:
         try:
-            g.current_user = User.objects(id=uid).first()
+            g.current_user = reads.queryset(User.objects(id=uid), 'account').first()
         except Exception:
             g.current_user = None
 
@@ -66,31 +274,77 @@ def inject_user():
 @app.route('/')
 def index():
     # Get the category from the request args (if any)
-    category = request.args.get('category', None)
-    if category:
-        # Query the database for books matching the category and sort them by title
-        filtered_books = Book.objects(category=category).order_by('title')
-    else:
-        # Query the database for all books and sort them by title
-        filtered_books = Book.objects().order_by('title')
+    category = request.args.get('category', '').strip() or None
+    # Serve from the in-memory replica when it is enabled and fresh enough
+    filtered_books = catalog_replica.list_books(category) if catalog_replica else None
+    if filtered_books is None:
+        # Books matching the category (or all books), sorted by title, as lightweight read-only views.
+        # Identical concurrent loads share one query; the list is shared, so it is never modified.
+        pref = reads.preference('catalog')
+        filtered_books = coalesced(('list_books', category, pref.name),
+                                   lambda: views.list_books(category, read_preference=pref))
 
     return render_template('index.html', books=filtered_books, category=category)
 
 @app.route('/book/<book_id>')
 def book_details(book_id):
-    try:
-        book = Book.objects.get(id=book_id)
-    except Book.DoesNotExist:
+    found, book = catalog_replica.get(book_id) if catalog_replica else (False, None)
+    if not found:
+        try:
+            pref = reads.preference('catalog')
+            book = coalesced(('book', book_id, pref.name),
+                             lambda: Book.objects.read_preference(pref).get(id=book_id))
+        except (Book.DoesNotExist, ValidationError):
+            book = None
+    if book is None:
         # handle 404 appropriately
         return "Book not found", 404
-    return render_template('book_details.html', book=book, panel='BOOK DETAILS')
+    return render_template('book_details.html', book=book, similar=similar_books(book), panel='BOOK DETAILS')
+
+@app.route('/covers/<book_id>')
+def cover(book_id):
+    """Serve a locally cached cover thumbnail, falling back to the original URL."""
+    try:
+        book = reads.queryset(Book.objects(id=book_id), 'catalog').only('url').first()
+    except ValidationError:
+        book = None
+    if not book or not book.url:
+        return "Cover not found", 404
+    try:
+        path = cover_cache.get(book.url)
+    except CoverFetchError:
+        # Image host unreachable or bad image: let the browser try the source directly
+        return redirect(book.url)
+    return send_file(path, max_age=app.config['COVER_MAX_AGE'], conditional=True, etag=True)
+
+@app.route('/events/availability')
+def availability_events():
+    """Server-sent events stream of {book_id, available} changes."""
+    sub = availability.subscribe()
+    if sub is None:
+        return "Too many live subscribers", 503, {'Retry-After': '30'}
+    response = Response(availability.stream(sub), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # HEAD requests and early disconnects never start the generator, so its own cleanup can't be relied on
+    response.call_on_close(lambda: availability.unsubscribe(sub))
+    return response
+
+@app.route('/suggest')
+def suggest():
+    """Type-ahead matches for titles and authors, most borrowed first."""
+    if not ensure_suggest_index():
+        return jsonify([])
+    results = suggest_index.lookup(request.args.get('q', ''), limit=8)
+    for r in results:
+        r['url'] = url_for('book_details', book_id=r['id'])
+    return jsonify(results)
 
 # -------------------- Loan Routes --------------------
 @app.route('/loans')
 @login_required
 def loans_list():
     user = g.current_user
-    loans = Loan.for_user(user)
+    loans = views.loans_for_user(user, read_preference=reads.preference('loans'))
     return render_template('loans.html', panel='CURRENT LOANS', loans=loans)
 
 @app.route('/loan/create/<book_id>', methods=['POST'])
@@ -107,6 +361,9 @@ def create_loan(book_id):
         flash('Book not found.', 'danger')
         return redirect(url_for('index'))
     loan, created, msg = Loan.create_loan(user, book)
+    if created:
+        reads.pin_primary()
+        suggest_index.bump(book.id)
     flash(msg, 'success' if created else 'warning')
     return redirect(request.referrer or url_for('index'))
 
@@ -119,6 +376,8 @@ def renew_loan(loan_id):
         flash('Loan not found.', 'danger')
     else:
         ok, msg = loan.renew()
+        if ok:
+            reads.pin_primary()
         flash(msg, 'success' if ok else 'warning')
     return redirect(url_for('loans_list'))
 
@@ -131,6 +390,8 @@ def return_loan(loan_id):
         flash('Loan not found.', 'danger')
     else:
         ok, msg = loan.return_book()
+        if ok:
+            reads.pin_primary()
         flash(msg, 'success' if ok else 'warning')
     return redirect(url_for('loans_list'))
 
@@ -143,6 +404,8 @@ def delete_loan(loan_id):
         flash('Loan not found.', 'danger')
     else:
         ok, msg = loan.delete_if_allowed()
+        if ok:
+            reads.pin_primary()
         flash(msg, 'success' if ok else 'warning')
     return redirect(url_for('loans_list'))
 
@@ -173,9 +436,14 @@ def register():
                 username = f"{base_username}{suffix}"
                 suffix += 1
 
-            u = User(username=username, email=email, name=name)
-            u.set_password(password)
+            try:
+                password_hash = hasher.hash(password)
+            except HasherBusy:
+                flash('The server is busy. Please try again in a moment.', 'warning')
+                return render_template('register.html', panel='REGISTER'), 503
+            u = User(username=username, email=email, name=name, password_hash=password_hash)
             u.save()
+            reads.pin_primary()
             flash('Registration successful. Please log in.', 'success')
             return redirect(url_for('login'))
 
@@ -191,7 +459,21 @@ def login():
         email = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '').strip()
         user = User.objects(email=email).first()
-        if user and user.check_password(password):
+        try:
+            if user:
+                ok = hasher.verify(user.password_hash, password)
+            else:
+                ok = hasher.verify_missing(password)  # same cost as a wrong password
+        except HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html', panel='LOGIN'), 503
+        if ok:
+            if hasher.needs_rehash(user.password_hash):
+                # Upgrade legacy or lower-cost hashes while we have the plain password
+                try:
+                    User.objects(id=user.id).update_one(set__password_hash=hasher.hash(password))
+                except HasherBusy:
+                    pass  # try again on a later login
             session['user_id'] = str(user.id)
             session['is_admin'] = bool(user.is_admin)
             session['name'] = user.name
@@ -282,6 +564,10 @@ def new_book():
                 available=copies
             )
             b.save()
+            reads.pin_primary()
+            cover_cache.prefetch(b.url)
+            similar_index.add(b.id, b.title, b.genres, b.category, b.authors)
+            suggest_index.add(b.id, b.title, b.authors)
             created_book = b
             flash(f'"{b.title}" created successfully.','success')
             # Reset form
@@ -305,5 +591,113 @@ def profile():
     user = g.get('current_user')
     return render_template('profile.html', panel='PROFILE', user=user)
 
+@app.route('/admin/reports')
+@admin_required
+def reports():
+    try:
+        days = min(max(int(request.args.get('days', 365)), 1), 366)
+    except ValueError:
+        days = 365
+    return render_template('reports.html', panel='REPORTS', report=rollups.report(days=days, read_preference=reads.preference('reports')))
+
+@app.route('/admin/export/<kind>')
+@admin_required
+def export_download(kind):
+    """Stream books or loans as NDJSON or CSV (?format=csv), optionally gzipped (?gzip=1)."""
+    fmt = request.args.get('format', 'ndjson')
+    if kind not in ('books', 'loans') or fmt not in export.FORMATS:
+        return "Unknown export", 404
+    if kind == 'books':
+        rows = export.iter_books(reads.collection(Book._get_collection(), 'reports'))
+        fields = export.BOOK_FIELDS
+    else:
+        rows = export.iter_loans(reads.collection(Loan._get_collection(), 'reports'),
+                                 reads.collection(User._get_collection(), 'reports'),
+                                 reads.collection(Book._get_collection(), 'reports'))
+        fields = export.LOAN_FIELDS
+    chunks = export.encode(rows, fmt, fields)
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d}.{fmt}"
+    mimetype = export.FORMATS[fmt]
+    if request.args.get('gzip'):
+        chunks, filename, mimetype = export.gzipped(chunks), filename + '.gz', 'application/gzip'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/metrics')
+@admin_required
+def metrics_view():
+    return jsonify(metrics.snapshot())
+
+# -------------------- CLI Commands --------------------
+@app.cli.command('reconcile-loan-counters')
+@click.option('--batch-size', default=1000, show_default=True, help='Users updated per bulk write.')
+def reconcile_loan_counters_command(batch_size):
+    """Rebuild users' loan counters from the loans collection; run once after upgrading."""
+    members = reconcile_loan_counters(batch_size=batch_size)
+    click.echo(f"Reconciled loan counters for {members} member(s) with loans.")
+
+@app.cli.command('compress-descriptions')
+@click.option('--batch-size', default=500, show_default=True, help='Books converted per bulk write.')
+def compress_descriptions_command(batch_size):
+    """Move plain book descriptions into compressed storage and report the size change."""
+    before = books_storage_report()
+    converted = compress_descriptions(batch_size=batch_size)
+    after = books_storage_report()
+    click.echo(f"Converted {converted} book(s).")
+    for key in before:
+        click.echo(f"  {key:<20} {before[key]!s:>12} -> {after.get(key)!s:>12}")
+
+@app.cli.command('rebuild-rollups')
+@click.option('--window-days', default=31, show_default=True, help='Days checked per aggregation.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+def rebuild_rollups_command(window_days, restart):
+    """Add loans missing from the daily circulation rollups (e.g. ones older than the rollups)."""
+    written = rollups.rebuild_rollups(Loan._get_collection(), Book._get_collection(),
+                                      window_days=window_days, resume=not restart)
+    click.echo(f"Updated {written} day rollup(s).")
+
+def write_export(rows, stats, fmt, fields, output, gz):
+    chunks = export.encode(rows, fmt, fields)
+    if gz:
+        chunks = export.gzipped(chunks)
+    next_report = 1_000_000
+    with click.open_file(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+            if stats.rows >= next_report:
+                click.echo(f"  {stats.rows:,} rows, {stats.rows_per_sec:,.0f} rows/s", err=True)
+                next_report += 1_000_000
+    click.echo(f"Exported {stats.rows:,} row(s) in {stats.elapsed:.1f}s ({stats.rows_per_sec:,.0f} rows/s).", err=True)
+
+export_options = [
+    click.option('--format', 'fmt', type=click.Choice(sorted(export.FORMATS)), default='ndjson', show_default=True),
+    click.option('--output', '-o', default='-', show_default=True, help='File to write, or - for stdout.'),
+    click.option('--gzip', 'gz', is_flag=True, help='Gzip the output.'),
+    click.option('--batch-size', default=1000, show_default=True, help='Documents fetched per cursor batch.'),
+]
+
+def with_export_options(f):
+    for option in reversed(export_options):
+        f = option(f)
+    return f
+
+@app.cli.command('export-books')
+@with_export_options
+def export_books_command(fmt, output, gz, batch_size):
+    """Stream the books collection to NDJSON or CSV."""
+    stats = export.ExportStats()
+    rows = export.iter_books(Book._get_collection(), batch_size=batch_size, stats=stats)
+    write_export(rows, stats, fmt, export.BOOK_FIELDS, output, gz)
+
+@app.cli.command('export-loans')
+@with_export_options
+@click.option('--cache-size', default=10_000, show_default=True, help='Members/books kept for resolving references.')
+def export_loans_command(fmt, output, gz, batch_size, cache_size):
+    """Stream loan history, with member and book fields resolved, to NDJSON or CSV."""
+    stats = export.ExportStats()
+    rows = export.iter_loans(Loan._get_collection(), User._get_collection(), Book._get_collection(),
+                             batch_size=batch_size, cache_size=cache_size, stats=stats)
+    write_export(rows, stats, fmt, export.LOAN_FIELDS, output, gz)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""Audit trail for loan actions, written off the request path.
+
+`Loan.create_loan`, `renew`, `return_book` and `delete_if_allowed` call
+`audit.record(...)`, which only appends the event to an in-process queue.
+A background writer thread drains that queue into the `audit_log` collection
+with `insert_many`. It writes a batch as soon as `batch_size` events are
+waiting, or every `flush_interval` seconds, whichever comes first. So a loan
+action never waits on an extra round trip.
+
+The queue is bounded by `max_queue`. When it is full, the `overflow` policy
+decides what happens:
+
+  drop_new     the new event is dropped (default; requests are never slowed)
+  drop_oldest  the oldest queued event is dropped to make room
+  block        the request waits up to `block_timeout` seconds for room, then drops
+
+A batch whose write fails is retried up to `retries` times, waiting
+`retry_backoff` seconds and then doubling the wait each time. If the sink
+reports which documents failed (pymongo's BulkWriteError does), only those
+are retried. Documents rejected as duplicates were already stored by an
+earlier attempt, so they count as written. Only events still unwritten
+after the last retry count as failed.
+
+Dropped events and failed writes are counted rather than raised. Events
+still queued at interpreter exit are flushed by an atexit hook.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+DUPLICATE_KEY = 11000
+
+
+class AuditLog:
+    POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+    def __init__(self, max_queue=10_000, batch_size=500, flush_interval=1.0,
+                 overflow='drop_new', block_timeout=0.05, retries=3, retry_backoff=0.1):
+        self._sink = None
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)  # writer waits for events
+        self._space = threading.Condition(self._lock)  # producers / flush() wait for the writer
+        self._thread = None
+        self._closed = False
+        self._in_flight = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+        self.last_error = None
+        self.configure(max_queue=max_queue, batch_size=batch_size, flush_interval=flush_interval,
+                       overflow=overflow, block_timeout=block_timeout, retries=retries, retry_backoff=retry_backoff)
+
+    def configure(self, sink=None, max_queue=None, batch_size=None, flush_interval=None,
+                  overflow=None, block_timeout=None, retries=None, retry_backoff=None):
+        """Set the sink and limits. `sink(docs)` persists a list of event dicts;
+        until one is set, record() is a no-op, which turns auditing off."""
+        if overflow is not None and overflow not in self.POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(self.POLICIES)}")
+        with self._lock:
+            if sink is not None:
+                self._sink = sink
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if batch_size is not None:
+                self.batch_size = batch_size
+            if flush_interval is not None:
+                self.flush_interval = flush_interval
+            if overflow is not None:
+                self.overflow = overflow
+            if block_timeout is not None:
+                self.block_timeout = block_timeout
+            if retries is not None:
+                self.retries = retries
+            if retry_backoff is not None:
+                self.retry_backoff = retry_backoff
+
+    # -------------------- Producers --------------------
+    def record(self, action: str, **fields):
+        """Queue one event; returns False if it was dropped."""
+        if self._sink is None:
+            return False
+        event = {'action': action, 'at': datetime.utcnow(), **fields}
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif self.overflow == 'block':
+                    self._ready.notify()
+                    if not self._space.wait_for(lambda: len(self._queue) < self.max_queue or self._closed,
+                                                timeout=self.block_timeout) or self._closed:
+                        self.dropped += 1
+                        return False
+                else:
+                    self.dropped += 1
+                    return False
+            self._queue.append(event)
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._ready.notify()
+            if self._thread is None:
+                self._start()
+        return True
+
+    def _start(self):
+        # Caller holds the lock
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # -------------------- Writer --------------------
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._queue) < self.batch_size and not self._closed:
+                    self._ready.wait(self.flush_interval)
+                if not self._queue:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+                self._space.notify_all()
+            self._write(batch)
+            with self._lock:
+                self._in_flight = 0
+                self._space.notify_all()
+
+    def _write(self, batch):
+        delay = self.retry_backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+                self.retried += len(batch)
+            try:
+                self._sink(batch)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                batch = self._unwritten(batch, e)
+                if not batch:
+                    break
+            else:
+                self.written += len(batch)
+                break
+        else:
+            self.failed += len(batch)
+        self.batches += 1
+
+    def _unwritten(self, batch, error):
+        """The documents of `batch` still to write after `error`."""
+        errors = (getattr(error, 'details', None) or {}).get('writeErrors')
+        if not errors:
+            return batch  # nothing says which ones failed: retry them all
+        retry = [batch[e['index']] for e in errors if e.get('code') != DUPLICATE_KEY]
+        self.written += len(batch) - len(retry)
+        return retry
+
+    def flush(self, timeout=5.0) -> bool:
+        """Wait until everything queued so far has been written (or failed)."""
+        with self._lock:
+            if self._thread is None:
+                return not self._queue
+            self._ready.notify()
+            return self._space.wait_for(lambda: not self._queue and not self._in_flight, timeout=timeout)
+
+    def close(self, timeout=5.0):
+        """Stop accepting events, write what is queued and stop the writer."""
+        with self._lock:
+            self._closed = True
+            self._ready.notify()
+            self._space.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def metrics(self) -> dict:
+        return {
+            'queue_depth': len(self._queue), 'max_queue': self.max_queue, 'overflow': self.overflow,
+            'enqueued': self.enqueued, 'written': self.written, 'batches': self.batches,
+            'dropped': self.dropped, 'retried': self.retried, 'failed': self.failed, 'last_error': self.last_error,
+        }
+
+
+# Shared instance; app.py points it at the audit_log collection at startup
+audit = AuditLog()
+
+
+if __name__ == '__main__':
+    # Cost per loan action of auditing inline vs through the queue: python audit.py [round trip ms]
+    import sys
+    import time
+
+    rtt = (float(sys.argv[1]) if len(sys.argv) > 1 else 1.0) / 1000
+    writes = []
+
+    def slow_insert(docs):  # stand-in for one insert round trip to MongoDB
+        time.sleep(rtt)
+        writes.append(len(docs))
+
+    n = 2000
+    t0 = time.perf_counter()
+    for i in range(n):
+        slow_insert([{'action': 'loan.create', 'at': datetime.utcnow(), 'loan': i}])
+    inline = (time.perf_counter() - t0) / n
+
+    log = AuditLog(batch_size=200, flush_interval=0.2)
+    log.configure(sink=slow_insert)
+    writes.clear()
+    t0 = time.perf_counter()
+    for i in range(n):
+        log.record('loan.create', loan=i)
+    queued = (time.perf_counter() - t0) / n
+    log.flush()
+    print(f"inline insert: {inline * 1e6:,.0f} us per action")
+    print(f"queued:        {queued * 1e6:,.1f} us per action, {len(writes)} insert_many calls for {sum(writes)} events")
+    print(log.metrics())
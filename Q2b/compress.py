@@ -0,0 +1,209 @@
+"""Response compression for HTML, JSON and other text responses.
+
+An after_request hook picks an encoding from the client's Accept-Encoding.
+That is brotli if the `brotli` package is installed and accepted, otherwise
+gzip. Responses that already have a Content-Encoding, that are served
+straight from a file (covers), that aren't a text type, or that are
+event streams are passed through untouched.
+
+Buffered responses smaller than `min_size` are sent as-is, because the gzip
+header and the CPU aren't worth it. Larger ones get an ETag computed from
+the uncompressed body, with the encoding appended, for example "abc...-gzip".
+That ETag is used two ways:
+  - If the client already has that representation (If-None-Match), it gets
+    a 304 and nothing is compressed.
+  - Otherwise the compressed bytes are looked up in a small LRU keyed on the
+    ETag. The same catalog page is only compressed once until it changes.
+
+Streamed responses are compressed chunk by chunk with a sync flush after
+each chunk, so the client still receives every chunk as soon as it is
+produced.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+
+try:  # brotli is optional; without it only gzip is offered
+    import brotli
+except ImportError:  # pragma: no cover - depends on environment
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+                'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml'}
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16+15: gzip container
+
+    def chunk(self, data):
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+
+class _BrotliStream:
+    def __init__(self, quality):
+        self._b = brotli.Compressor(quality=quality)
+
+    def chunk(self, data):
+        return self._b.process(data) + self._b.flush()
+
+    def finish(self):
+        return self._b.finish()
+
+
+class Compressor:
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5, cache_entries=256):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache_entries = cache_entries
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._cache = OrderedDict()  # (etag, encoding) -> compressed bytes
+        self._lock = threading.Lock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+        self.streamed = 0
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', self.min_size)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', self.gzip_level)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', self.brotli_quality)
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        app.after_request(self.after_request)
+
+    # -------------------- Encoders --------------------
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return zlib.compress(data, self.gzip_level, wbits=31)
+
+    def stream(self, encoding: str):
+        if encoding == 'br':
+            return _BrotliStream(self.brotli_quality)
+        return _GzipStream(self.gzip_level)
+
+    def _cached(self, key, data, encoding):
+        with self._lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return body
+        body = self.compress(data, encoding)
+        with self._lock:
+            self._cache[key] = body
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return body
+
+    # -------------------- Hook --------------------
+    def after_request(self, response):
+        from flask import request
+
+        if (response.mimetype not in COMPRESSIBLE or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.status_code < 200 or response.status_code in (204, 304)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream_body(response.response, self.stream(encoding))
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+            with self._lock:
+                self.streamed += 1
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        etag, weak = response.get_etag()
+        if etag is None:
+            response.add_etag()
+            etag, weak = response.get_etag()
+        etag = f"{etag}-{encoding}"
+        response.set_etag(etag, weak=weak)
+        if request.if_none_match.contains_weak(etag) if weak else request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Length', None)
+            return response
+        body = self._cached((etag, encoding), data, encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(body)
+        return response
+
+    @staticmethod
+    def _stream_body(chunks, encoder):
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                out = encoder.chunk(chunk)
+                if out:
+                    yield out
+            yield encoder.finish()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def metrics(self) -> dict:
+        return {
+            'encodings': list(self.encodings), 'compressed': self.compressed, 'streamed': self.streamed,
+            'cache_hits': self.cache_hits, 'not_modified': self.not_modified, 'cached_entries': len(self._cache),
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+        }
+
+
+if __name__ == '__main__':
+    # Bytes saved and CPU per page at each level: python compress.py [page.html]
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            page = f.read()
+    else:  # a catalog page's worth of cards built from the seed books
+        from html import escape
+
+        import books
+        card = ('<div class="card mb-3 book-card"><div class="row g-0"><div class="col-md-2">'
+                '<img src="/covers/{i}" class="img-fluid rounded-start" alt="Cover of {title}"></div>'
+                '<div class="col-md-10"><div class="card-body d-flex flex-column h-100">'
+                '<h5 class="card-title">{title}</h5><p class="card-text"><small>{authors}</small></p>'
+                '{paragraphs}</div></div></div></div>\n')
+        page = ''.join(card.format(
+            i=i, title=escape(b['title']), authors=escape(', '.join(b.get('authors', []))),
+            paragraphs=''.join(f'<p class="card-text">{escape(p)}</p>' for p in b.get('description', [])))
+            for i, b in enumerate(books.all_books)).encode()
+    print(f"page: {len(page):,} bytes")
+    codecs = [(f"gzip -{level}", lambda d, level=level: zlib.compress(d, level, wbits=31)) for level in (1, 6, 9)]
+    if brotli is not None:
+        codecs += [(f"br q{q}", lambda d, q=q: brotli.compress(d, quality=q)) for q in (1, 5, 11)]
+    for label, fn in codecs:
+        rounds = 50
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            out = fn(page)
+        cpu = (time.perf_counter() - t0) / rounds
+        print(f"{label:<8} {len(out):>8,} bytes ({1 - len(out) / len(page):.1%} saved)  {cpu * 1000:6.2f} ms/request")
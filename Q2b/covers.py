@@ -0,0 +1,248 @@
+"""Local cover-image cache.
+
+Book covers are hot-linked from an external image host. This module fetches
+each cover once, stores a thumbnail on local disk and lets the app serve it
+from `/covers/<book_id>` with long cache headers.
+
+Layout on disk (content-addressed):
+    <root>/blobs/<aa>/<sha256 of thumbnail bytes>.<ext>
+    <root>/refs/<sha256 of "<width>:<source url>">   -> text file holding the blob name
+
+Two books pointing at the same image share one blob.
+
+Thumbnails are made with Pillow (listed in requirements.txt). If it is not
+installed, the original image bytes are cached unresized.
+
+A failed download is remembered for `failure_ttl` seconds. While the image
+host is down, requests then redirect straight to the source URL instead of
+each one waiting out the fetch timeout. Expired failures are swept once
+more than `max_failures` are held. Per-URL download locks exist only while
+someone is fetching that URL.
+
+`prefetch_all()` warms the whole catalog on one background thread. At most
+`max_pending` downloads are queued at a time, and the walk waits for room.
+Only one process per cache directory runs it: the others skip it when they
+can't take an flock on `<root>/prefetch.lock`, so gunicorn workers don't
+all download the same covers.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:  # POSIX only; elsewhere every process prefetches
+    import fcntl
+except ImportError:  # pragma: no cover - depends on platform
+    fcntl = None
+
+try:  # in requirements.txt; without it the original bytes are cached as-is
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on environment
+    Image = None
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+
+
+class CoverFetchError(Exception):
+    """Raised when a cover could not be downloaded or decoded."""
+
+
+class CoverCache:
+    def __init__(self, root, width=300, timeout=5, max_bytes=5 * 1024 * 1024, workers=2, failure_ttl=300,
+                 max_failures=10_000, max_pending=256):
+        self.root = root
+        self.width = width
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.max_failures = max_failures
+        self._failures = {}  # url -> (retry_after, message)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cover-prefetch')
+        self._pending = threading.BoundedSemaphore(max_pending)  # prefetches queued or running
+        self._prefetch_lock_file = None
+        # One lock per source URL being fetched, so concurrent requests for a cold cover only download it once
+        self._locks = {}  # url -> [lock, holders]
+        self._locks_guard = threading.Lock()
+
+    # -------------------- Paths --------------------
+    def _ref_path(self, url: str) -> str:
+        key = hashlib.sha256(f"{self.width}:{url}".encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'refs', key)
+
+    def _blob_path(self, blob_name: str) -> str:
+        return os.path.join(self.root, 'blobs', blob_name[:2], blob_name)
+
+    @contextmanager
+    def _url_lock(self, url: str):
+        with self._locks_guard:
+            entry = self._locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[url]
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def _recent_failure(self, url: str):
+        failure = self._failures.get(url)
+        if failure is None:
+            return None
+        if failure[0] <= time.monotonic():
+            self._failures.pop(url, None)
+            return None
+        return failure[1]
+
+    def _record_failure(self, url: str, message: str):
+        now = time.monotonic()
+        if len(self._failures) >= self.max_failures:
+            for key, (retry_after, _) in list(self._failures.items()):
+                if retry_after <= now:
+                    self._failures.pop(key, None)
+            while len(self._failures) >= self.max_failures:  # all still fresh: forget the oldest
+                self._failures.pop(next(iter(self._failures)), None)
+        self._failures[url] = (now + self.failure_ttl, message)
+
+    # -------------------- Lookup --------------------
+    def lookup(self, url: str):
+        """Return the cached thumbnail path for `url`, or None if not cached yet."""
+        try:
+            with open(self._ref_path(url), 'r', encoding='ascii') as fh:
+                blob_name = fh.read().strip()
+        except OSError:
+            return None
+        path = self._blob_path(blob_name)
+        return path if os.path.exists(path) else None
+
+    def get(self, url: str) -> str:
+        """Return the thumbnail path for `url`, downloading it on a cache miss.
+
+        Raises CoverFetchError if the cover cannot be fetched, or if fetching
+        it failed less than `failure_ttl` seconds ago.
+        """
+        if not url:
+            raise CoverFetchError("Book has no cover URL.")
+        path = self.lookup(url)
+        if path:
+            return path
+        failure = self._recent_failure(url)
+        if failure:
+            raise CoverFetchError(failure)
+        with self._url_lock(url):
+            path = self.lookup(url)  # another thread may have filled it while we waited
+            if path:
+                return path
+            failure = self._recent_failure(url)  # or failed to
+            if failure:
+                raise CoverFetchError(failure)
+            try:
+                data, content_type = self._download(url)
+                data, ext = self._thumbnail(data, content_type)
+            except CoverFetchError as exc:
+                self._record_failure(url, str(exc))
+                raise
+            blob_name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+            blob_path = self._blob_path(blob_name)
+            if not os.path.exists(blob_path):
+                self._write_atomic(blob_path, data)
+            self._write_atomic(self._ref_path(url), blob_name.encode('ascii'))
+            return blob_path
+
+    # -------------------- Fetch & Resize --------------------
+    def _download(self, url: str):
+        req = urllib.request.Request(url, headers={'User-Agent': 'sg-library-cover-cache'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                content_type = resp.headers.get_content_type()
+                data = resp.read(self.max_bytes + 1)
+        except (OSError, ValueError) as exc:
+            raise CoverFetchError(f"Could not fetch cover: {exc}") from exc
+        if len(data) > self.max_bytes:
+            raise CoverFetchError("Cover image too large.")
+        if not content_type.startswith('image/'):
+            raise CoverFetchError(f"Unexpected content type {content_type!r}.")
+        return data, content_type
+
+    def _thumbnail(self, data: bytes, content_type: str):
+        """Downscale to `self.width` pixels wide. Returns (bytes, extension)."""
+        if Image is None:
+            return data, EXTENSIONS.get(content_type, 'img')
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                if img.width > self.width:
+                    height = max(1, round(img.height * self.width / img.width))
+                    img = img.resize((self.width, height), Image.LANCZOS)
+                out = io.BytesIO()
+                img.convert('RGB').save(out, format='JPEG', quality=85, optimize=True)
+        except Exception as exc:  # Pillow raises a variety of decode errors
+            raise CoverFetchError(f"Could not decode cover: {exc}") from exc
+        return out.getvalue(), 'jpg'
+
+    # -------------------- Background Prefetch --------------------
+    def prefetch(self, url: str, block=False) -> bool:
+        """Warm the cache for `url` on a background worker. Failures are ignored.
+
+        Returns False if `max_pending` prefetches are already queued (unless `block`).
+        """
+        if not url or self.lookup(url) or self._recent_failure(url):
+            return True
+        if not self._pending.acquire(blocking=block):
+            return False
+        try:
+            self._executor.submit(self._prefetch_one, url)
+        except BaseException:
+            self._pending.release()
+            raise
+        return True
+
+    def prefetch_many(self, urls):
+        """Prefetch each URL, waiting for room in the queue rather than dropping any."""
+        for url in urls:
+            self.prefetch(url, block=True)
+
+    def prefetch_all(self, urls_fn) -> bool:
+        """Prefetch `urls_fn()` on a background thread, in at most one process per cache directory.
+
+        `urls_fn` is called on that thread, so a catalog query doesn't run at startup.
+        Returns False if another process holds the prefetch lock.
+        """
+        if fcntl is not None:
+            os.makedirs(self.root, exist_ok=True)
+            lock_file = open(os.path.join(self.root, 'prefetch.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._prefetch_lock_file = lock_file  # held for the life of the process
+        threading.Thread(target=lambda: self.prefetch_many(urls_fn()), name='cover-prefetch-walk',
+                         daemon=True).start()
+        return True
+
+    def _prefetch_one(self, url: str):
+        try:
+            self.get(url)
+        except CoverFetchError:
+            pass
+        finally:
+            self._pending.release()
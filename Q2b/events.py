@@ -0,0 +1,127 @@
+"""Server-sent events for live book availability.
+
+`Book.borrow_one` / `Book.return_one` publish `(book_id, available)` to the
+shared `availability` broadcaster, which fans each change out to every open
+`/events/availability` stream.
+
+Memory per subscriber is bounded: pending changes are coalesced per book
+(only the latest count matters), and if a slow client still accumulates more
+than `max_pending` distinct books it is sent a single `resync` event instead,
+telling the page to reload.
+
+The subscriber slot is taken in the route, so a full server can answer 503
+at once. It is released by `Response.call_on_close`, not by the generator:
+a HEAD request, or a client that disconnects before the first frame, never
+runs the generator at all.
+
+Every open stream holds one worker thread for as long as the page is open.
+So the real limit is `max_subscribers` live pages per process
+(AVAILABILITY_MAX_SUBSCRIBERS, 16 by default). Under a threaded server (the
+dev server, or gunicorn's gthread worker) keep it well below the thread
+count, so pages and loan actions still get threads. Pages beyond the limit
+get a 503. The script in base.html then retries with a backoff growing from
+5 s to 2 min, so they pick up live updates once a slot frees. Changes made
+while a page waits are not replayed to it; loan actions are still checked
+on the server. Holding thousands of idle streams needs a green-thread
+worker, where an idle stream costs almost nothing, plus a higher limit:
+
+    gunicorn -k gevent --worker-connections 2000 app:app
+"""
+
+import json
+import threading
+
+
+class Subscription:
+    __slots__ = ('pending', 'overflow', 'cond', 'closed')
+
+    def __init__(self):
+        self.pending = {}
+        self.overflow = False
+        self.cond = threading.Condition(threading.Lock())
+        self.closed = False
+
+
+class AvailabilityBroadcaster:
+    def __init__(self, max_subscribers=5000, max_pending=256, heartbeat=15.0):
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self.heartbeat = heartbeat
+        self._subs = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.rejected = 0
+
+    def configure(self, max_subscribers=None, heartbeat=None):
+        if max_subscribers is not None:
+            self.max_subscribers = max_subscribers
+        if heartbeat is not None:
+            self.heartbeat = heartbeat
+
+    def subscribe(self):
+        """Return a new Subscription, or None if the subscriber limit is reached."""
+        with self._lock:
+            if len(self._subs) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            sub = Subscription()
+            self._subs.add(sub)
+            return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+        with sub.cond:
+            sub.closed = True
+            sub.cond.notify()
+
+    def publish(self, book_id: str, available: int):
+        with self._lock:
+            subs = list(self._subs)
+            self.published += 1
+        for sub in subs:
+            with sub.cond:
+                if not sub.overflow:
+                    sub.pending[book_id] = available
+                    if len(sub.pending) > self.max_pending:
+                        sub.pending.clear()
+                        sub.overflow = True
+                sub.cond.notify()
+
+    def stream(self, sub: Subscription):
+        """Generator of SSE frames for one client.
+
+        Unsubscribes if the generator is closed, but the caller must also
+        unsubscribe when the response closes, in case it never starts.
+        """
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                with sub.cond:
+                    if not (sub.pending or sub.overflow or sub.closed):
+                        sub.cond.wait(self.heartbeat)
+                    if sub.closed:
+                        return
+                    changes, sub.pending = sub.pending, {}
+                    overflow, sub.overflow = sub.overflow, False
+                if overflow:
+                    yield "event: resync\ndata: {}\n\n"
+                elif changes:
+                    for book_id, available in changes.items():
+                        yield f"data: {json.dumps({'book_id': book_id, 'available': available})}\n\n"
+                else:
+                    # Comment line keeps proxies from timing out and surfaces dead connections
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def metrics(self) -> dict:
+        return {
+            'subscribers': len(self._subs),
+            'published': self.published,
+            'rejected_subscribers': self.rejected,
+        }
+
+
+# Shared instance used by the models and the SSE route
+availability = AvailabilityBroadcaster()
@@ -0,0 +1,22 @@
+"""Tiny in-process metrics registry.
+
+Subsystems register a callable that returns a dict of numbers; the admin-only
+`/metrics` route returns a snapshot of all of them as JSON.
+"""
+
+_sources = {}
+
+
+def register(name: str, fn):
+    """Register `fn() -> dict` under `name` (replaces any previous source)."""
+    _sources[name] = fn
+
+
+def snapshot() -> dict:
+    out = {}
+    for name, fn in list(_sources.items()):
+        try:
+            out[name] = fn()
+        except Exception as exc:  # a broken source should not hide the others
+            out[name] = {'error': str(exc)}
+    return out
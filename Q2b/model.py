@@ -1,11 +1,27 @@
 from flask_mongoengine import Document
 from mongoengine.fields import (
-    StringField, ListField, IntField, BooleanField, ReferenceField, DateTimeField
+    StringField, ListField, IntField, BooleanField, ReferenceField, DateTimeField, BinaryField
 )
-from mongoengine import CASCADE, DENY
+from mongoengine import CASCADE, DENY, Q
+from pymongo import UpdateOne
 from datetime import datetime, timedelta
 from random import randint
+import json
+import zlib
 import books as book_data # Import the hardcoded book data
+from passwords import hasher
+from events import availability
+from audit import audit
+import rollups
+
+def summarize_description(paragraphs):
+    """First and last paragraph, which is all a catalog card shows."""
+    return paragraphs[:1] + paragraphs[-1:] if len(paragraphs) >= 2 else list(paragraphs)
+
+def compress_description(paragraphs):
+    """Return (zlib-compressed JSON of all paragraphs, summary list)."""
+    raw = json.dumps(paragraphs, ensure_ascii=False).encode('utf-8')
+    return zlib.compress(raw, 9), summarize_description(paragraphs)
 
 class Book(Document):
     GENRES = [
@@ -23,18 +39,28 @@ class Book(Document):
     genres = ListField(StringField())
     category = StringField()
     url = StringField()
+    # Full paragraphs are stored zlib-compressed in description_z; list views only read summary.
+    # `description` is the input field (and holds legacy documents not yet migrated).
     description = ListField(StringField())
+    description_z = BinaryField()
+    summary = ListField(StringField())
     pages = IntField()
     available = IntField()
     copies = IntField()
-    
-    meta = {'collection': 'books'}
+    updated_at = DateTimeField(default=datetime.utcnow)
+    # Bumped only when a field shown on catalog cards changes (not on loans), see fragments.py
+    card_version = IntField(default=0)
+
+    meta = {'collection': 'books', 'indexes': ['updated_at']}
+
+    CARD_FIELDS = frozenset(('title', 'authors', 'category', 'pages', 'summary', 'description'))
 
     def clean(self):
-        """Ensure description is always stored as a list of non-empty strings.
+        """Normalize description to a list of non-empty strings, then compress it.
 
         MongoEngine calls `clean` before validation on save. This prevents any
-        accidental assignment of a single string or None to `description`.
+        accidental assignment of a single string or None to `description`, and
+        moves any newly assigned paragraphs into `description_z` / `summary`.
         """
         if self.description is None:
             self.description = []
@@ -44,11 +70,33 @@ class Book(Document):
         elif isinstance(self.description, list):
             # Filter to strings, strip whitespace, drop empties
             self.description = [p.strip() for p in self.description if isinstance(p, str) and p.strip()]
+        if self.description:
+            # Move the paragraphs into compressed storage
+            self.description_z, self.summary = compress_description(self.description)
+            self.description = []
+        changed = {name.split('.', 1)[0] for name in self._get_changed_fields()}
+        if changed & self.CARD_FIELDS:
+            self.card_version = (self.card_version or 0) + 1
+        # Bumped on every save so the in-process catalog replica can poll for changes
+        self.updated_at = datetime.utcnow()
+
+    @property
+    def full_description(self) -> list:
+        """All paragraphs, decompressed on access (only the detail page needs them)."""
+        if self.description_z:
+            return json.loads(zlib.decompress(self.description_z).decode('utf-8'))
+        return list(self.description or [])
+
+    @property
+    def card_description(self) -> list:
+        """Paragraphs shown on catalog cards: the first and, if different, the last."""
+        return list(self.summary or summarize_description(self.description or []))
 
     @property
     def first_paragraph(self) -> str:
         """Convenience accessor for templates: returns first paragraph or empty string."""
-        return self.description[0] if self.description else ""
+        paragraphs = self.card_description
+        return paragraphs[0] if paragraphs else ""
 
     # -------------------- Availability Helpers (Part b iii) --------------------
     def can_borrow(self) -> bool:
@@ -73,6 +121,7 @@ class Book(Document):
             self.available = 0
             return False, "Availability underflow prevented."
         self.save()
+        availability.publish(str(self.id), self.available)
         return True, "Book availability decremented."
 
     def return_one(self):
@@ -88,6 +137,7 @@ class Book(Document):
             self.available = self.copies
             return False, "Availability overflow corrected to copies count."
         self.save()
+        availability.publish(str(self.id), self.available)
         return True, "Book availability incremented."
 
     @staticmethod
@@ -137,17 +187,22 @@ class User(Document):
     is_admin = BooleanField(default=False)
     created_at = DateTimeField(default=datetime.utcnow)
 
+    # Loan counters, maintained with $inc by Loan and rebuilt by reconcile_loan_counters().
+    # The totals count every loan and renewal ever made, so deleting a returned loan record
+    # leaves them alone; active_loans never goes below zero.
+    active_loans = IntField(default=0)
+    total_loans = IntField(default=0)
+    total_renewals = IntField(default=0)
+    counters_reconciled_at = DateTimeField()
+
     meta = {'collection': 'users', 'indexes': ['username', 'email', 'is_admin']}
 
-    # Convenience helpers kept simple; you could swap for passlib or werkzeug.security
+    # Salted PBKDF2 via passwords.hasher; legacy SHA-256 hashes still verify and are upgraded on login
     def set_password(self, raw_password: str):
-        # Basic hashing (NOT for production). Replace with werkzeug.security.generate_password_hash
-        import hashlib
-        self.password_hash = hashlib.sha256(raw_password.encode('utf-8')).hexdigest()
+        self.password_hash = hasher.hash_now(raw_password)
 
     def check_password(self, raw_password: str) -> bool:
-        import hashlib
-        return self.password_hash == hashlib.sha256(raw_password.encode('utf-8')).hexdigest()
+        return hasher.verify_now(self.password_hash, raw_password)
 
 def seed_users():
     """Seed specified admin and non-admin users if they do not exist.
@@ -211,11 +266,15 @@ class Loan(Document):
     due_date = DateTimeField(required=True)
     return_date = DateTimeField()
     renew_count = IntField(default=0)
+    # When the loan was made; renew changes borrow_date. Set by create_loan, never defaulted:
+    # a default would stamp older loans with today's date whenever they are loaded.
+    created_at = DateTimeField()
 
     meta = {
         'collection': 'loans',
         'indexes': [
             '-borrow_date',  # for sorting newest first
+            'created_at',    # rollups.rebuild_rollups() windows
             {'fields': ['member', 'book', 'return_date']},
         ]
     }
@@ -223,6 +282,7 @@ class Loan(Document):
     # Constants / configuration
     LOAN_PERIOD_DAYS = 14
     MAX_RENEWS = 2
+    MAX_ACTIVE_LOANS = 5
     RANDOM_PAST_MIN = 10  # creation: borrow date = today - rand(10..20)
     RANDOM_PAST_MAX = 20
     RANDOM_FUTURE_MIN = 10  # renew/return generation relative to existing borrow date
@@ -253,10 +313,15 @@ class Loan(Document):
         if book.available <= 0:
             return None, False, "No available copies for this title."
 
+        # Reserve an active-loan slot atomically; the filter enforces the cap without a count query
+        under_cap = Q(active_loans__lt=cls.MAX_ACTIVE_LOANS) | Q(active_loans__exists=False)
+        if not User.objects(Q(id=user.id) & under_cap).update_one(inc__active_loans=1, inc__total_loans=1):
+            return None, False, f"You can have at most {cls.MAX_ACTIVE_LOANS} active loans."
+
         borrow_date = cls._random_past_borrow_date()
         due_date = borrow_date + timedelta(days=cls.LOAN_PERIOD_DAYS)
 
-        loan = cls(member=user, book=book, borrow_date=borrow_date, due_date=due_date)
+        loan = cls(member=user, book=book, borrow_date=borrow_date, due_date=due_date, created_at=datetime.utcnow())
         loan.save()
 
         # Decrement availability using Book helper
@@ -264,7 +329,10 @@ class Loan(Document):
         if not success:
             # Rollback loan if borrow failed (extremely unlikely due to earlier check)
             loan.delete()
+            User.objects(id=user.id).update_one(dec__active_loans=1, dec__total_loans=1)
             return None, False, "Failed to adjust availability."
+        rollups.record_loan(loan.created_at, book)
+        audit.record('loan.create', loan=loan.id, member=user.id, book=book.id, due_date=due_date)
         return loan, True, "Loan created successfully."
 
     @classmethod
@@ -276,6 +344,15 @@ class Loan(Document):
         return cls.objects(member=user, id=loan_id).first()
 
     # -------------------- State & Helper Properties --------------------
+    def _member_id(self):
+        """Member ObjectId without dereferencing the User document."""
+        ref = self._data.get('member')
+        return getattr(ref, 'id', ref)
+
+    def _book_id(self):
+        ref = self._data.get('book')
+        return getattr(ref, 'id', ref)
+
     @property
     def is_returned(self) -> bool:
         return self.return_date is not None
@@ -317,6 +394,11 @@ class Loan(Document):
         self.due_date = self.borrow_date + timedelta(days=self.LOAN_PERIOD_DAYS)
         self.renew_count += 1
         self.save()
+        User.objects(id=self._member_id()).update_one(inc__total_renewals=1)
+        if self.created_at:  # older loans aren't in the rollups until rebuild_rollups() backfills them
+            rollups.record_renewal(self.created_at, self._book_id())
+        audit.record('loan.renew', loan=self.id, member=self._member_id(), book=self._book_id(),
+                     due_date=self.due_date, renew_count=self.renew_count)
         return True, "Loan renewed."
 
     def return_book(self):
@@ -330,17 +412,108 @@ class Loan(Document):
         if self.return_date < self.borrow_date:
             self.return_date = datetime.utcnow()
         self.save()
+        # Loans made before the counters existed were never counted; don't go negative for them
+        User.objects(id=self._member_id(), active_loans__gt=0).update_one(dec__active_loans=1)
         # Restore availability via helper
         self.book.return_one()
+        audit.record('loan.return', loan=self.id, member=self._member_id(), book=self._book_id(),
+                     return_date=self.return_date)
         return True, "Book returned."
 
     def delete_if_allowed(self):
         if not self.can_delete:
             return False, "Only returned loans can be deleted."
         self.delete()
+        # The rollups keep counting it: deleting the record doesn't undo the loan
+        audit.record('loan.delete', loan=self.id, member=self._member_id(), book=self._book_id())
         return True, "Loan deleted."
 
     # -------------------- Validation Hook --------------------
     def clean(self):
         if not self.due_date and self.borrow_date:
-            self.due_date = self.borrow_date + timedelta(days=self.LOAN_PERIOD_DAYS)
\ No newline at end of file
+            self.due_date = self.borrow_date + timedelta(days=self.LOAN_PERIOD_DAYS)
+
+
+def reconcile_loan_counters(batch_size=1000):
+    """Rebuild every user's loan counters from the `loans` collection.
+
+    One aggregation groups loans by member; results are written back with bulk
+    updates of `batch_size`. `active_loans` is set exactly. The lifetime totals
+    are only ever raised (`$max`), because deleted loan records can't be counted
+    again. Users with no loans get zero active loans. Loans created while this
+    runs may be counted slightly off, so run it at a quiet time.
+
+    This is also the migration for the counters: run it once after deploying
+    them, so loans made before they existed are counted.
+
+    Returns the number of users that have loans.
+    """
+    run_at = datetime.utcnow()
+    users = User._get_collection()
+    pipeline = [{'$group': {
+        '_id': '$member',
+        'active': {'$sum': {'$cond': [{'$ifNull': ['$return_date', False]}, 0, 1]}},
+        'total': {'$sum': 1},
+        'renewals': {'$sum': {'$ifNull': ['$renew_count', 0]}},
+    }}]
+    ops, members = [], 0
+    for row in Loan._get_collection().aggregate(pipeline, allowDiskUse=True):
+        ops.append(UpdateOne({'_id': row['_id']}, {
+            '$set': {'active_loans': row['active'], 'counters_reconciled_at': run_at},
+            '$max': {'total_loans': row['total'], 'total_renewals': row['renewals']},
+        }))
+        members += 1
+        if len(ops) >= batch_size:
+            users.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        users.bulk_write(ops, ordered=False)
+    # Anyone not touched above has no loans on record
+    users.update_many(
+        {'counters_reconciled_at': {'$ne': run_at}},
+        {'$set': {'active_loans': 0, 'counters_reconciled_at': run_at},
+         '$max': {'total_loans': 0, 'total_renewals': 0}},
+    )
+    return members
+
+
+def compress_descriptions(batch_size=500):
+    """Migrate books that still store plain `description` lists to compressed storage.
+
+    Works through the collection in batches of `batch_size` with bulk updates.
+    Returns the number of books converted.
+    """
+    books = Book._get_collection()
+    converted, ops = 0, []
+    cursor = books.find({'description.0': {'$exists': True}}, {'description': 1}, batch_size=batch_size)
+    for doc in cursor:
+        paragraphs = [p.strip() for p in doc['description'] if isinstance(p, str) and p.strip()]
+        blob, summary = compress_description(paragraphs)
+        ops.append(UpdateOne({'_id': doc['_id']}, {
+            '$set': {'description_z': blob, 'summary': summary, 'updated_at': datetime.utcnow()},
+            '$inc': {'card_version': 1},
+            '$unset': {'description': ''},
+        }))
+        if len(ops) >= batch_size:
+            converted += books.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        converted += books.bulk_write(ops, ordered=False).modified_count
+    return converted
+
+
+def books_storage_report(page_size=20):
+    """Sizes relevant to the description migration, in bytes."""
+    import bson
+    books = Book._get_collection()
+    report = {}
+    try:
+        stats = books.database.command('collStats', books.name)
+        report.update({k: stats.get(k) for k in ('count', 'size', 'storageSize', 'avgObjSize', 'totalIndexSize')})
+    except Exception:
+        pass  # collStats is unavailable on some deployments; the per-page numbers still work
+    listing = list(books.find({}, {'description_z': 0}).sort('title', 1).limit(page_size))
+    detail = books.find_one({}, sort=[('title', 1)])
+    report['listing_page_bytes'] = sum(len(bson.encode(d)) for d in listing)
+    report['detail_doc_bytes'] = len(bson.encode(detail)) if detail else 0
+    return report
@@ -0,0 +1,159 @@
+"""Password hashing service.
+
+Hashes use werkzeug's salted PBKDF2 with a configurable iteration count.
+Because a slow KDF is the point, `hash()` and `verify()` run on a small
+bounded worker pool instead of on the request thread's own schedule: at most
+`workers` hashes run at once, at most `max_pending` more may wait, and any
+request beyond that fails fast with HasherBusy instead of piling up.
+
+Hashes from the old scheme (a bare unsalted SHA-256 hex digest) still verify,
+and `needs_rehash()` reports them so login can upgrade them in place.
+
+`verify_missing()` is for logins to an unknown email. It runs the same KDF
+against a dummy hash, so the response takes as long as a wrong password
+does and its timing doesn't reveal which emails have accounts.
+"""
+
+import hashlib
+import hmac
+import re
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated or a hash took too long."""
+
+
+class PasswordHasher:
+    def __init__(self, iterations=600_000, workers=2, max_pending=16, timeout=5.0):
+        self._executor = None
+        self._dummy = None
+        self._dummy_lock = threading.Lock()
+        self.configure(iterations=iterations, workers=workers, max_pending=max_pending, timeout=timeout)
+
+    def configure(self, iterations=None, workers=None, max_pending=None, timeout=None):
+        """(Re)build the pool with new settings. Call once at startup."""
+        if iterations is not None:
+            self.iterations = iterations
+        if workers is not None:
+            self.workers = workers
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if timeout is not None:
+            self.timeout = timeout
+        old = self._executor
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self.rejected = 0
+        if old is not None:
+            old.shutdown(wait=False)
+
+    @property
+    def method(self) -> str:
+        return f'pbkdf2:sha256:{self.iterations}'
+
+    # -------------------- Synchronous (startup / seeding) --------------------
+    def hash_now(self, raw_password: str) -> str:
+        return generate_password_hash(raw_password, method=self.method)
+
+    def verify_now(self, stored_hash: str, raw_password: str) -> bool:
+        if not stored_hash:
+            return False
+        if LEGACY_SHA256.match(stored_hash):
+            legacy = hashlib.sha256(raw_password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(stored_hash, legacy)
+        return check_password_hash(stored_hash, raw_password)
+
+    def _dummy_hash(self) -> str:
+        # Made on first use at the current cost, so it costs the same to check as a real hash
+        with self._dummy_lock:
+            if self._dummy is None or not self._dummy.startswith(self.method + '$'):
+                self._dummy = self.hash_now(secrets.token_hex(16))
+            return self._dummy
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """True for legacy SHA-256 hashes and for hashes made with a different method/cost."""
+        if not stored_hash or LEGACY_SHA256.match(stored_hash):
+            return True
+        return stored_hash.split('$', 1)[0] != self.method
+
+    # -------------------- Pooled (request handlers) --------------------
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy("Password hashing queue is full.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout as exc:
+            raise HasherBusy("Password hashing timed out.") from exc
+
+    def hash(self, raw_password: str) -> str:
+        return self._run(self.hash_now, raw_password)
+
+    def verify(self, stored_hash: str, raw_password: str) -> bool:
+        return self._run(self.verify_now, stored_hash, raw_password)
+
+    def verify_missing(self, raw_password: str) -> bool:
+        """Burn one verification for a login with no matching user; always False."""
+        self._run(lambda: self.verify_now(self._dummy_hash(), raw_password))
+        return False
+
+    def metrics(self) -> dict:
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected,
+        }
+
+
+# Shared instance; app.py configures it from app.config at startup
+hasher = PasswordHasher()
+
+
+if __name__ == '__main__':
+    # Login throughput at a given cost: python passwords.py [iterations] [concurrent clients]
+    import sys
+    import time
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 600_000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    h = PasswordHasher(iterations=iterations, workers=4, max_pending=64, timeout=60)
+    stored = h.hash_now('12345')
+    latencies = []
+    busy = 0
+
+    def client():
+        global busy
+        for _ in range(10):
+            t0 = time.perf_counter()
+            try:
+                h.verify(stored, '12345')
+                latencies.append(time.perf_counter() - t0)
+            except HasherBusy:
+                busy += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float('nan')
+    print(f"{h.method}, {clients} clients, {h.workers} workers")
+    print(f"{len(latencies) / elapsed:.1f} logins/s, p99 {p99 * 1000:.0f} ms, {busy} rejected")
@@ -0,0 +1,91 @@
+"""Token-bucket admission control for the loan mutation endpoints.
+
+Each (client, endpoint) pair gets its own bucket holding up to `capacity`
+tokens, refilled at `rate` tokens per second. A request spends one token; if
+the bucket is empty the request is rejected straight away (the app returns
+429 before any database work is done).
+
+State is per process. Buckets that have refilled completely carry no
+information, so they are dropped during periodic sweeps to keep memory
+bounded by the number of recently active clients.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now: float) -> float:
+        """Spend one token. Returns 0 on success, else seconds until a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    def __init__(self, rules, sweep_every=1000, clock=time.monotonic):
+        """`rules` maps endpoint name -> (capacity, refill tokens per second)."""
+        self.rules = dict(rules)
+        self.clock = clock
+        self.sweep_every = sweep_every
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.allowed = {endpoint: 0 for endpoint in self.rules}
+        self.rejected = {endpoint: 0 for endpoint in self.rules}
+
+    def limits(self, endpoint) -> bool:
+        return endpoint in self.rules
+
+    def hit(self, endpoint: str, client: str) -> float:
+        """Record one request. Returns 0 if allowed, else the suggested Retry-After in seconds."""
+        capacity, rate = self.rules[endpoint]
+        now = self.clock()
+        key = (client, endpoint)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(capacity, rate, now)
+            wait = bucket.take(now)
+            if wait:
+                self.rejected[endpoint] += 1
+            else:
+                self.allowed[endpoint] += 1
+            self._calls += 1
+            if self._calls % self.sweep_every == 0:
+                self._sweep(now)
+        return wait
+
+    def _sweep(self, now: float):
+        # Caller holds the lock
+        idle = [key for key, bucket in self._buckets.items() if bucket.is_full(now)]
+        for key in idle:
+            del self._buckets[key]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'active_buckets': len(self._buckets),
+                'allowed': dict(self.allowed),
+                'rejected': dict(self.rejected),
+            }
+
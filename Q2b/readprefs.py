@@ -0,0 +1,125 @@
+"""Read preferences per query class.
+
+Each read in app.py names a class: catalog, account, loans or reports.
+app.config['READ_PREFERENCES'] maps each class to a read preference mode,
+optionally with a max staleness in seconds. For example, catalog pages can
+be served by a secondary while a member's own loans always come from the
+primary. Writes always go to the primary.
+
+Read-your-writes: after a request changes data (loan actions, registration,
+adding a book), the route calls `pin_primary()`. That stores a deadline in
+the user's session. Until the deadline passes, every read for that browser
+goes to the primary. So the redirect after a write never shows state from a
+secondary that hasn't caught up yet, whether it goes back to loans_list or
+to the catalog page the user came from. Causally consistent sessions would
+give the same guarantee, but a ClientSession can't be threaded through
+MongoEngine querysets.
+
+Without a replica set, every mode ends up on the single server.
+"""
+
+import time
+from collections import Counter
+
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+MODES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+SESSION_KEY = '_primary_until'
+
+
+class ReadRouter:
+    def __init__(self, classes=None, pin_seconds=10.0):
+        self._prefs = {}
+        self.pin_seconds = pin_seconds
+        self.reads = Counter()
+        self.pinned_reads = 0
+        self.configure(classes or {})
+
+    def configure(self, classes, pin_seconds=None):
+        """`classes`: {name: mode} or {name: (mode, max_staleness_seconds)}."""
+        prefs = {}
+        for name, spec in classes.items():
+            mode, max_staleness = spec if isinstance(spec, (tuple, list)) else (spec, None)
+            if mode not in MODES:
+                raise ValueError(f"Unknown read preference {mode!r} for {name!r}")
+            if mode == 'primary':
+                prefs[name] = Primary()  # max staleness is not allowed with primary
+            else:
+                prefs[name] = MODES[mode](max_staleness=max_staleness if max_staleness is not None else -1)
+        self._prefs = prefs
+        if pin_seconds is not None:
+            self.pin_seconds = pin_seconds
+
+    # -------------------- Read-your-writes --------------------
+    def pin_primary(self):
+        """Send this browser's reads to the primary for the next `pin_seconds`."""
+        from flask import session
+        session[SESSION_KEY] = time.time() + self.pin_seconds
+
+    def pinned(self) -> bool:
+        from flask import has_request_context, session
+        return has_request_context() and session.get(SESSION_KEY, 0) > time.time()
+
+    # -------------------- Routing --------------------
+    def preference(self, query_class: str):
+        self.reads[query_class] += 1
+        if self.pinned():
+            self.pinned_reads += 1
+            return Primary()
+        return self._prefs.get(query_class, Primary())
+
+    def queryset(self, qs, query_class: str):
+        return qs.read_preference(self.preference(query_class))
+
+    def collection(self, coll, query_class: str):
+        return coll.with_options(read_preference=self.preference(query_class))
+
+    def metrics(self) -> dict:
+        return {
+            'classes': {name: pref.document for name, pref in self._prefs.items()},
+            'reads': dict(self.reads),
+            'pinned_to_primary': self.pinned_reads,
+        }
+
+
+if __name__ == '__main__':
+    # Check routing against a local replica set, e.g. three mongod on one machine:
+    #   mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0   (and 27018, 27019)
+    #   mongosh --eval 'rs.initiate({_id: "rs0", members: [{_id: 0, host: "localhost:27017"},
+    #                   {_id: 1, host: "localhost:27018"}, {_id: 2, host: "localhost:27019"}]})'
+    #   python readprefs.py "mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+    import sys
+
+    from pymongo import MongoClient, monitoring
+
+    class ServerLog(monitoring.CommandListener):
+        def __init__(self):
+            self.last = None
+
+        def started(self, event):
+            if event.command_name in ('find', 'aggregate'):
+                self.last = event.connection_id
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    uri = sys.argv[1] if len(sys.argv) > 1 else 'mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0'
+    log = ServerLog()
+    client = MongoClient(uri, event_listeners=[log])
+    books = client['ict_239_library']['books']
+    books.find_one()  # wait for topology discovery
+    router = ReadRouter({'catalog': ('secondaryPreferred', 90), 'loans': 'primary'})
+    print(f"primary: {client.primary}, secondaries: {sorted(client.secondaries)}")
+    for query_class in ('catalog', 'loans'):
+        router.collection(books, query_class).find_one()
+        role = 'primary' if log.last == client.primary else 'secondary'
+        print(f"{query_class:<8} -> {log.last[0]}:{log.last[1]} ({role})")
@@ -0,0 +1,251 @@
+"""In-process read replica of the `books` collection.
+
+The whole catalog is small enough to keep in memory, so `index` and
+`book_details` can be served without a Mongo round trip (the same idea Q2a
+uses with its hardcoded list).
+
+The replica loads `books` once, then stays current in a background thread:
+  - with a change stream when Mongo runs as a replica set. The stream starts
+    at the cluster time read just before the load, so writes made during the
+    load are replayed rather than lost. After an error it resumes from the
+    last resume token.
+  - otherwise by polling for documents whose `updated_at` is at or after the
+    newest one seen, minus `poll_overlap` seconds. The overlap catches
+    writes that commit late or come from app hosts with a slower clock.
+    Documents already held with the same `updated_at` are skipped.
+    Polling can't see deletes, so every `reconcile_interval` seconds the
+    ids in the collection are compared with the ids held, and missing
+    books are dropped. If that check hasn't succeeded for
+    `reconcile_interval + max_staleness` seconds, the replica reports itself
+    stale and reads go back to Mongo.
+Writes made by this process are also applied immediately through the
+mongoengine post_save and post_delete signals, so a user sees their own loan reflected at once.
+
+The title order is kept as a sorted key list updated with bisect, so a
+change never re-sorts the catalog. The tuple handed to readers is rebuilt
+at most once per read after any number of changes.
+
+Reads are only served while the replica is fresh: if the last successful sync
+is older than `max_staleness` seconds, callers get None and fall back to Mongo.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from mongoengine import signals
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+class CatalogReplica:
+    def __init__(self, document_cls, poll_interval=2.0, max_staleness=10.0, poll_overlap=5.0,
+                 reconcile_interval=60.0):
+        self.document_cls = document_cls
+        self.poll_interval = poll_interval
+        self.max_staleness = max_staleness
+        self.poll_overlap = poll_overlap
+        self.reconcile_interval = reconcile_interval
+
+        self._books = {}          # str(id) -> Book
+        self._order = []          # sorted (title, str(id)) keys
+        # (all books in title order, {category: tuple of books}) swapped as one snapshot
+        self._views = ((), {})
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.mode = None           # 'change_stream' or 'polling'
+        self.last_sync = 0.0       # time.monotonic() of last successful sync
+        self._high_water = None    # newest updated_at seen (polling)
+        self._start_at = None      # cluster time read before the last full load (change stream)
+        self._resume_token = None
+        self._last_reconcile = 0.0  # time.monotonic() of the last id check (polling)
+        self.applied = 0
+        self.errors = 0
+
+    # -------------------- Lifecycle --------------------
+    def start(self):
+        """Load the collection and start the background sync thread."""
+        self._full_load()
+        signals.post_save.connect(self._on_local_save, sender=self.document_cls)
+        signals.post_delete.connect(self._on_local_delete, sender=self.document_cls)
+        self._thread = threading.Thread(target=self._run, name='catalog-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _cluster_time(self):
+        """Current operation time, or None on a standalone server."""
+        client = self.document_cls._get_collection().database.client
+        try:
+            with client.start_session() as session:
+                client.admin.command('ping', session=session)
+                return session.operation_time
+        except (PyMongoError, NotImplementedError):
+            return None
+
+    def _full_load(self):
+        started = datetime.utcnow()
+        self._start_at = self._cluster_time()  # read first: anything written from here on is replayed
+        self._resume_token = None
+        books = {str(b.id): b for b in self.document_cls.objects()}
+        with self._lock:
+            self._books = books
+            self._order = sorted((b.title or '', book_id) for book_id, b in books.items())
+            self._dirty = True
+            self._high_water = started - timedelta(seconds=1)
+            self.last_sync = self._last_reconcile = time.monotonic()
+
+    def _snapshot(self):
+        # New tuples are swapped in whole, so readers never see a half-built view
+        with self._lock:
+            if self._dirty:
+                self._views = (tuple(self._books[book_id] for _, book_id in self._order), {})
+                self._dirty = False
+            return self._views
+
+    # -------------------- Applying Changes --------------------
+    def _remove_key(self, book_id):
+        # Caller holds the lock
+        old = self._books.pop(book_id, None)
+        if old is not None:
+            key = (old.title or '', book_id)
+            i = bisect_left(self._order, key)
+            if i < len(self._order) and self._order[i] == key:
+                del self._order[i]
+
+    def _apply(self, books=(), deleted_ids=()):
+        """Apply a batch of saved books and deleted ids under one lock."""
+        with self._lock:
+            for deleted_id in deleted_ids:
+                self._remove_key(str(deleted_id))
+                self.applied += 1
+            for book in books:
+                book_id = str(book.id)
+                old = self._books.get(book_id)
+                if old is not None and (old.title or '') == (book.title or ''):
+                    self._books[book_id] = book  # position unchanged
+                else:
+                    self._remove_key(book_id)
+                    self._books[book_id] = book
+                    insort(self._order, (book.title or '', book_id))
+                if book.updated_at and (self._high_water is None or book.updated_at > self._high_water):
+                    self._high_water = book.updated_at
+                self.applied += 1
+            self._dirty = True
+
+    def _on_local_save(self, sender, document, **kwargs):
+        self._apply(books=(document,))
+
+    def _on_local_delete(self, sender, document, **kwargs):
+        self._apply(deleted_ids=(document.id,))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.mode != 'polling':
+                    self._watch()  # returns only if change streams are unsupported
+                self.mode = 'polling'
+                self._poll()
+            except PyMongoError:
+                self.errors += 1
+            self._stop.wait(self.poll_interval)
+
+    def _watch(self):
+        collection = self.document_cls._get_collection()
+        if self._resume_token is not None:
+            position = {'resume_after': self._resume_token}
+        elif self._start_at is not None:
+            position = {'start_at_operation_time': self._start_at}
+        else:
+            position = {}
+        try:
+            with collection.watch(full_document='updateLookup', max_await_time_ms=1000, **position) as stream:
+                self.mode = 'change_stream'
+                self.last_sync = time.monotonic()
+                while not self._stop.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        op = change['operationType']
+                        if op == 'delete':
+                            self._apply(deleted_ids=(change['documentKey']['_id'],))
+                        elif change.get('fullDocument') is not None:
+                            self._apply(books=(self.document_cls._from_son(change['fullDocument']),))
+                    # An empty batch still proves the stream is caught up
+                    self._resume_token = stream.resume_token
+                    self.last_sync = time.monotonic()
+        except OperationFailure:
+            if self.mode != 'change_stream':
+                return  # standalone server: change streams need a replica set
+            # The resume point fell off the oplog: reload everything and watch again from there
+            self._full_load()
+
+    def _poll(self):
+        started = time.monotonic()
+        since = self._high_water
+        query = {'updated_at__gte': since - timedelta(seconds=self.poll_overlap)} if since else {}
+        changed = []
+        for book in self.document_cls.objects(**query):
+            held = self._books.get(str(book.id))
+            if held is None or held.updated_at != book.updated_at:  # the overlap re-reads unchanged books
+                changed.append(book)
+        if changed:
+            self._apply(books=changed)
+        if started - self._last_reconcile >= self.reconcile_interval:
+            self._reconcile_ids()
+        self.last_sync = started
+
+    def _reconcile_ids(self):
+        """Drop held books whose documents are gone. Only `_id` is read, from the _id index."""
+        started = time.monotonic()
+        held = set(self._books)  # books saved after this point can't be wrongly dropped
+        present = {str(son['_id']) for son in self.document_cls._get_collection().find({}, {'_id': 1})}
+        gone = held - present
+        if gone:
+            self._apply(deleted_ids=gone)
+        self._last_reconcile = started
+
+    # -------------------- Reads --------------------
+    def lag(self) -> float:
+        """Seconds since the replica was last known to be in sync."""
+        return time.monotonic() - self.last_sync if self.last_sync else float('inf')
+
+    def is_fresh(self) -> bool:
+        if self._thread is None or self.lag() > self.max_staleness:
+            return False
+        if self.mode == 'polling':  # deletes are only seen by the id check
+            return time.monotonic() - self._last_reconcile <= self.reconcile_interval + self.max_staleness
+        return True
+
+    def list_books(self, category=None):
+        """Title-sorted books (optionally by category), or None if the replica is stale."""
+        if not self.is_fresh():
+            return None
+        all_books, by_category = self._snapshot()
+        if not category:
+            return all_books
+        view = by_category.get(category)
+        if view is None:
+            # Cached on the snapshot it was derived from, so a concurrent rebuild cannot leave it stale
+            view = by_category[category] = tuple(b for b in all_books if b.category == category)
+        return view
+
+    def get(self, book_id):
+        """Return (found, book); found is False when the replica is stale and cannot answer."""
+        if not self.is_fresh():
+            return False, None
+        return True, self._books.get(str(book_id))
+
+    def metrics(self) -> dict:
+        return {
+            'mode': self.mode,
+            'books': len(self._books),
+            'lag_seconds': round(self.lag(), 3),
+            'fresh': self.is_fresh(),
+            'applied_changes': self.applied,
+            'ids_checked_seconds_ago': round(time.monotonic() - self._last_reconcile, 3) if self.mode == 'polling' else None,
+            'errors': self.errors,
+        }
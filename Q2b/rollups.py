@@ -0,0 +1,247 @@
+"""Daily circulation rollups behind the admin reports page.
+
+Each day with loan activity has one document in `rollup_daily`:
+
+    {_id: <midnight UTC>,
+     loans: n, renewals: n,
+     category: {"Adult": n, ...},
+     genre: {"Fantasy": n, ...},
+     books: {"<book id>": {title, loans, renewals}, ...}}
+
+A loan counts on the day it was created (`Loan.created_at`), and its
+renewals count on that same day. So "renewals / loans" over a period is the
+average number of renewals for loans opened in that period. Category and
+genre are copied from the book when the loan is made, so reports never join
+`books`.
+
+The Loan hooks keep the documents current with a single upsert using `$inc`
+per action. Deleting a returned loan's record leaves the rollups alone: the
+loan still happened, and the reports keep counting it with the category and
+genres it was counted under. So the rollups are the history of circulation,
+not a view of what is left in `loans`.
+
+Loans with no `created_at` predate the rollups. The hooks skip them, and
+`rebuild_rollups()` counts them once it has backfilled the field. It only
+ever adds what the day documents are missing, so it never undoes deleted
+loans. It works one window of days at a time and records a checkpoint after
+each window, so an interrupted run picks up where it stopped.
+
+A report over a year reads at most 365 small documents and never touches
+`loans`.
+"""
+
+import heapq
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from mongoengine.connection import get_db
+from pymongo import UpdateOne
+
+DAILY = 'rollup_daily'
+STATE = 'rollup_state'
+
+
+def day_of(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def _key(name) -> str:
+    # Field names may not contain '.' or start with '$'
+    return str(name).replace('.', '_').replace('$', '_')
+
+
+def _update(book_id, title=None, category=None, genres=(), loans=0, renewals=0):
+    book = f'books.{book_id}'
+    inc = {}
+    if loans:
+        inc['loans'] = loans
+        inc[f'{book}.loans'] = loans
+        if category:
+            inc[f'category.{_key(category)}'] = loans
+        for genre in genres or ():
+            inc[f'genre.{_key(genre)}'] = loans
+    if renewals:
+        inc['renewals'] = renewals
+        inc[f'{book}.renewals'] = renewals
+    update = {'$inc': inc}
+    if title is not None:
+        update['$set'] = {f'{book}.title': title}
+    return update
+
+
+# -------------------- Loan hooks --------------------
+def record_loan(day: datetime, book):
+    get_db()[DAILY].update_one({'_id': day_of(day)},
+                               _update(book.id, book.title, book.category, book.genres, loans=1), upsert=True)
+
+
+def record_renewal(day: datetime, book_id):
+    get_db()[DAILY].update_one({'_id': day_of(day)}, _update(book_id, renewals=1), upsert=True)
+
+
+# -------------------- Batch rebuild --------------------
+def rebuild_rollups(loans, books, window_days=31, resume=True, batch_size=1000):
+    """Add to `rollup_daily` whatever the `loans` collection shows it is missing.
+
+    Loans saved before `created_at` existed get their borrow date copied into
+    it first. Days are then processed `window_days` at a time: one
+    aggregation groups that window's loans by (day, book), and each book's
+    loans and renewals are compared with its entry in the day document.
+    Where the loans collection shows more, the difference is added to the
+    day (and to the book's current category and genres). Where it shows
+    fewer, the day document is kept as it is, since the missing loans were
+    deleted after being counted. After each window a checkpoint is saved in
+    `rollup_state`; with `resume` a later run continues from there. Loans
+    made while a window is being processed may be counted twice, so run it
+    at a quiet time, as with reconcile_loan_counters().
+
+    Returns the number of day documents changed.
+    """
+    db = get_db()
+    daily, state = db[DAILY], db[STATE]
+
+    ops = []
+    for son in loans.find({'created_at': {'$exists': False}}, {'borrow_date': 1}):
+        ops.append(UpdateOne({'_id': son['_id']}, {'$set': {'created_at': son['borrow_date']}}))
+        if len(ops) >= batch_size:
+            loans.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        loans.bulk_write(ops, ordered=False)
+
+    first = loans.find_one({}, {'created_at': 1}, sort=[('created_at', 1)])
+    if first is None:
+        state.delete_one({'_id': DAILY})
+        return 0
+    checkpoint = (state.find_one({'_id': DAILY}) or {}).get('checkpoint') if resume else None
+    lo = checkpoint or day_of(first['created_at'])
+    end = day_of(datetime.utcnow()) + timedelta(days=1)
+
+    book_info, written = {}, 0
+    while lo < end:
+        hi = min(lo + timedelta(days=window_days), end)
+        pipeline = [
+            {'$match': {'created_at': {'$gte': lo, '$lt': hi}}},
+            {'$group': {
+                '_id': {'book': '$book', 'y': {'$year': '$created_at'},
+                        'm': {'$month': '$created_at'}, 'd': {'$dayOfMonth': '$created_at'}},
+                'loans': {'$sum': 1},
+                'renewals': {'$sum': {'$ifNull': ['$renew_count', 0]}},
+            }},
+        ]
+        rows = list(loans.aggregate(pipeline, allowDiskUse=True))
+        missing = {r['_id']['book'] for r in rows} - book_info.keys()
+        if missing:
+            for son in books.find({'_id': {'$in': list(missing)}}, {'title': 1, 'category': 1, 'genres': 1}):
+                book_info[son['_id']] = son
+        counted = {doc['_id']: doc.get('books') or {}
+                   for doc in daily.find({'_id': {'$gte': lo, '$lt': hi}}, {'books': 1})}
+        days = {}
+        for r in rows:
+            key, book = r['_id'], book_info.get(r['_id']['book'], {})
+            day = datetime(key['y'], key['m'], key['d'])
+            book_id = str(key['book'])
+            entry = counted.get(day, {}).get(book_id, {})
+            loans_short = max(r['loans'] - entry.get('loans', 0), 0)
+            renewals_short = max(r['renewals'] - entry.get('renewals', 0), 0)
+            if not (loans_short or renewals_short):
+                continue
+            update = _update(book_id, None if entry else book.get('title'), book.get('category'),
+                             book.get('genres'), loans=loans_short, renewals=renewals_short)
+            inc, title = days.setdefault(day, (Counter(), {}))
+            inc.update(update['$inc'])  # day totals, category and genre add up across books
+            title.update(update.get('$set', {}))
+        if days:
+            daily.bulk_write([UpdateOne({'_id': day}, {'$inc': dict(inc), **({'$set': title} if title else {})},
+                                        upsert=True)
+                              for day, (inc, title) in days.items()], ordered=False)
+        written += len(days)
+        lo = hi
+        state.update_one({'_id': DAILY}, {'$set': {'checkpoint': lo, 'updated_at': datetime.utcnow()}}, upsert=True)
+    state.update_one({'_id': DAILY}, {'$set': {'checkpoint': None, 'completed_at': datetime.utcnow()}}, upsert=True)
+    return written
+
+
+# -------------------- Reports --------------------
+def summarize(docs, top_n=10) -> dict:
+    """Fold day documents (oldest first) into the figures the reports page shows."""
+    loans = renewals = 0
+    by_category, by_genre = Counter(), Counter()
+    book_loans, book_renewals, titles = {}, {}, {}
+    daily = []
+    for doc in docs:
+        loans += doc.get('loans', 0)
+        renewals += doc.get('renewals', 0)
+        category = {k: v for k, v in (doc.get('category') or {}).items() if v}
+        genre = {k: v for k, v in (doc.get('genre') or {}).items() if v}
+        by_category.update(category)
+        by_genre.update(genre)
+        get_loans, get_renewals = book_loans.get, book_renewals.get
+        for book_id, b in (doc.get('books') or {}).items():
+            book_loans[book_id] = get_loans(book_id, 0) + b.get('loans', 0)
+            if 'renewals' in b:
+                book_renewals[book_id] = get_renewals(book_id, 0) + b['renewals']
+            if 'title' in b:
+                titles[book_id] = b['title']  # latest title wins
+        if doc.get('loans'):
+            daily.append({'day': doc['_id'], 'loans': doc['loans'], 'renewals': doc.get('renewals', 0),
+                          'category': category, 'genre': genre})
+    top = heapq.nlargest(top_n, (i for i, n in book_loans.items() if n > 0),
+                         key=lambda i: (book_loans[i], book_renewals.get(i, 0)))
+    return {
+        'loans': loans,
+        'renewals': renewals,
+        'avg_renewals': renewals / loans if loans else 0.0,
+        'by_category': [(k, v) for k, v in by_category.most_common() if v],
+        'by_genre': [(k, v) for k, v in by_genre.most_common() if v],
+        'top_titles': [{'id': i, 'title': titles.get(i), 'loans': book_loans[i], 'renewals': book_renewals.get(i, 0)}
+                       for i in top],
+        'daily': daily,
+    }
+
+
+_reports = {}  # (days, top_n) -> (expires_at, report)
+
+
+def report(days=365, top_n=10, cache_seconds=60.0, read_preference=None) -> dict:
+    """Circulation figures for the last `days` days, read from the rollups only.
+
+    Results are reused for `cache_seconds`, so reloading the dashboard doesn't
+    fold the same year of documents again.
+    """
+    now = time.monotonic()
+    cached = _reports.get((days, top_n))
+    if cached and cached[0] > now:
+        return cached[1]
+    start = day_of(datetime.utcnow()) - timedelta(days=days - 1)
+    daily = get_db()[DAILY]
+    if read_preference is not None:
+        daily = daily.with_options(read_preference=read_preference)
+    docs = daily.find({'_id': {'$gte': start}}).sort('_id', 1)
+    result = {'days': days, 'start': start, **summarize(docs, top_n=top_n)}
+    _reports[(days, top_n)] = (now + cache_seconds, result)
+    return result
+
+
+if __name__ == '__main__':
+    # Time to fold a year of day documents into a report: python rollups.py [books borrowed per day]
+    import random
+    import sys
+
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rng = random.Random(3)
+    genres = [f"Genre {i}" for i in range(26)]
+    today = day_of(datetime.utcnow())
+    docs = []
+    for d in range(365):
+        books = {str(rng.randrange(20_000)): {'title': 'T', 'loans': rng.randint(1, 4), 'renewals': rng.randint(0, 3)}
+                 for _ in range(per_day)}
+        docs.append({'_id': today - timedelta(days=364 - d), 'loans': sum(b['loans'] for b in books.values()),
+                     'renewals': sum(b['renewals'] for b in books.values()),
+                     'category': {c: rng.randint(10, 300) for c in ('Adult', 'Teens', 'Children')},
+                     'genre': {g: rng.randint(0, 100) for g in genres}, 'books': books})
+    t0 = time.perf_counter()
+    out = summarize(docs)
+    elapsed = time.perf_counter() - t0
+    print(f"365 days x {per_day} books/day: {out['loans']:,} loans summarized in {elapsed * 1000:.1f} ms")
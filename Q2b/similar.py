@@ -0,0 +1,343 @@
+""""Similar books" index for the detail page.
+
+Each book's genres become a bitmask over Book.GENRES (26 bits), so genre
+similarity is the Jaccard index of two masks, computed with int.bit_count().
+
+score(a, b) = jaccard(genres) + AUTHOR_WEIGHT * (share an author) + CATEGORY_WEIGHT * (same category)
+
+Books are grouped by genre mask (then category). A lookup walks outward from
+the book's own mask in Hamming distance: masks d bits away have Jaccard at
+most max(p/(p+d), (p-d)/p) for a book with p genres. It stops as soon as
+nothing further out can beat the current k-th result, so it never scans the
+catalog. Books that share an author are checked first, because they are the
+only ones that can beat their group's score. If fewer than k books lie
+within MAX_DISTANCE, or the k-th of them could still lose to a book further
+out, every group further out is scored and the best take their places, so
+results always match a brute-force ranking. Results are
+cached per book with the score of their k-th entry, so repeat lookups cost
+O(k). Adding a book drops only the cached results it would now enter.
+
+This departs from the original plan of a NumPy genre matrix with top-k
+precomputed for every book; NumPy isn't a dependency here. Precomputing
+would also repeat the whole catalog's work (about 40 s on one core for a
+synthetic 500k-book catalog) on every rebuild. Instead each book's top-k is
+computed on its first view and cached: at 500k books that took p50 0.04 ms,
+p99 0.3 ms, max 1.6 ms. `python similar.py [books]` reproduces these
+numbers and checks results against brute force.
+
+Lookups compute outside the lock. `build()` fills new tables and swaps them
+in whole, then replays the books `add()` was given while it ran, so a book
+created during a build isn't lost. `add()` replaces the lists it extends
+rather than appending to them. Either way a lookup keeps reading a
+consistent set of tables it grabbed at the start, and a result computed
+across a change isn't cached.
+"""
+
+import heapq
+import threading
+from itertools import combinations
+
+
+class SimilarityIndex:
+    AUTHOR_WEIGHT = 0.5
+    CATEGORY_WEIGHT = 0.1
+    MAX_DISTANCE = 4  # C(26, 4) = 14,950 masks probed at most at the last step
+
+    def __init__(self, genres, k=5):
+        self.k = k
+        self._bit = {g: i for i, g in enumerate(genres)}
+        self._nbits = len(genres)
+        self._books = {}        # book_id -> (title, mask, category, authors)
+        self._by_mask = {}      # mask -> {category: [book_id, ...]}
+        self._by_author = {}    # author -> [book_id, ...]
+        self._by_category = {}  # category -> [book_id, ...]
+        self._top = {}          # book_id -> (k computed for, [(book_id, title), ...], k-th score)
+        self._version = 0       # bumped by build/add; results computed across a change aren't cached
+        self._pending = None    # adds made while build() runs, replayed into its tables
+        self._lock = threading.Lock()
+        self.built = False
+
+    def _mask(self, genres) -> int:
+        mask = 0
+        for g in genres or ():
+            bit = self._bit.get(g)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    @staticmethod
+    def _jaccard(a: int, b: int) -> float:
+        union = (a | b).bit_count()
+        return (a & b).bit_count() / union if union else 0.0
+
+    def _score(self, a, b) -> float:
+        _, a_mask, a_category, a_authors = a
+        _, b_mask, b_category, b_authors = b
+        score = self._jaccard(a_mask, b_mask)
+        if not set(a_authors).isdisjoint(b_authors):
+            score += self.AUTHOR_WEIGHT
+        if a_category == b_category:
+            score += self.CATEGORY_WEIGHT
+        return score
+
+    # -------------------- Building --------------------
+    def build(self, rows):
+        """Rebuild from raw book documents (dicts with _id, title, genres, category, authors).
+
+        `rows` may be a lazy query: books added after it starts reading are
+        replayed once the new tables are in.
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        books, by_mask, by_author, by_category = {}, {}, {}, {}
+        try:
+            for row in rows:
+                book_id = str(row['_id'])
+                if book_id in books:
+                    continue
+                authors = tuple(row.get('authors') or ())
+                mask = self._mask(row.get('genres'))
+                category = row.get('category')
+                books[book_id] = (row.get('title'), mask, category, authors)
+                by_mask.setdefault(mask, {}).setdefault(category, []).append(book_id)
+                by_category.setdefault(category, []).append(book_id)
+                for author in authors:
+                    by_author.setdefault(author, []).append(book_id)
+        except BaseException:
+            with self._lock:
+                self._pending = None  # the next build reads those books from the database
+            raise
+        with self._lock:
+            self._books, self._by_mask, self._by_author, self._by_category = books, by_mask, by_author, by_category
+            self._top = {}
+            self._version += 1
+            self.built = True
+            for args in self._pending:
+                self._add(*args)  # skipped if the query already saw it
+            self._pending = None
+
+    def add(self, book_id, title, genres, category, authors):
+        """Add one book (e.g. after new_book) without rebuilding the index.
+
+        Before the first build this is a no-op: the build reads the book from
+        the database. During a build it is also kept for the new tables.
+        """
+        args = (str(book_id), title, self._mask(genres), category, tuple(authors or ()))
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(args)
+            if self.built:
+                self._add(*args)
+
+    def _add(self, book_id, title, mask, category, authors):
+        # Caller holds the lock
+        if book_id in self._books:
+            return
+        entry = (title, mask, category, authors)
+        # New lists rather than appends: lookups in progress may be iterating the old ones
+        groups = dict(self._by_mask.get(mask, {}))
+        groups[category] = groups.get(category, []) + [book_id]
+        self._by_mask[mask] = groups
+        self._by_category[category] = self._by_category.get(category, []) + [book_id]
+        for author in authors:
+            self._by_author[author] = self._by_author.get(author, []) + [book_id]
+        self._books[book_id] = entry
+        self._version += 1
+        # Only books the new one would now rank among can have a different top-k
+        stale = [other for other, (_, _, floor) in self._top.items()
+                 if self._score(self._books[other], entry) >= floor]
+        for other in stale:
+            del self._top[other]
+
+    # -------------------- Queries --------------------
+    def _compute(self, tables, book_id, k):
+        """Return ([(book_id, title), ...], score of the k-th result or -inf if fewer than k)."""
+        books, by_mask, by_author, by_category = tables
+        _, mask, category, authors = books[book_id]
+        best = []  # min-heap of (score, tiebreak, book_id)
+        seen = {book_id}
+        counter = 0
+
+        def offer(score, other):
+            nonlocal counter
+            counter += 1
+            item = (score, -counter, other)  # earlier candidates win ties
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+        def full_and_beats(score):
+            return len(best) >= k and best[0][0] >= score
+
+        # Shared authors first: the only books that can score above their group
+        for author in authors:
+            for other in by_author.get(author, ()):
+                if other not in seen:
+                    seen.add(other)
+                    _, o_mask, o_category, _ = books[other]
+                    score = self._jaccard(mask, o_mask) + self.AUTHOR_WEIGHT
+                    offer(score + (self.CATEGORY_WEIGHT if o_category == category else 0.0), other)
+
+        p = mask.bit_count()
+
+        def bound(d):  # best Jaccard any mask at Hamming distance d can reach
+            if not p:
+                return 0.0
+            return max(p / (p + d), (p - d) / p if d <= p else 0.0)
+
+        frontier = []  # max-heap of (-score, tiebreak, [book_id, ...]) for groups not yet consumed
+        for d in range(self.MAX_DISTANCE + 1):
+            for bits in combinations(range(self._nbits), d):
+                probe = mask
+                for b in bits:
+                    probe ^= 1 << b
+                groups = by_mask.get(probe)
+                if groups:
+                    j = self._jaccard(mask, probe)
+                    for c, ids in groups.items():
+                        score = j + (self.CATEGORY_WEIGHT if c == category else 0.0)
+                        heapq.heappush(frontier, (-score, len(frontier), ids))
+            # Consume groups that nothing further out can beat
+            reach = bound(d + 1) + self.CATEGORY_WEIGHT if d < self.MAX_DISTANCE else float('-inf')
+            while frontier and -frontier[0][0] >= reach:
+                neg_score, _, ids = heapq.heappop(frontier)
+                if full_and_beats(-neg_score):
+                    frontier = []
+                    break
+                for other in ids:
+                    if other not in seen:
+                        seen.add(other)
+                        offer(-neg_score, other)
+                        if full_and_beats(-neg_score):
+                            break
+            if full_and_beats(reach) and not frontier:
+                break
+
+        # The k-th result may still lose to a group beyond MAX_DISTANCE (or there were fewer
+        # than k within it): rank every group further out. That is one score per
+        # (mask, category), so it costs O(distinct masks), not O(books).
+        if not full_and_beats(bound(self.MAX_DISTANCE + 1) + self.CATEGORY_WEIGHT):
+            rest = []
+            for o_mask, groups in list(by_mask.items()):  # add() may insert masks meanwhile
+                if (mask ^ o_mask).bit_count() > self.MAX_DISTANCE:
+                    j = self._jaccard(mask, o_mask)
+                    for c, ids in groups.items():
+                        rest.append((j + (self.CATEGORY_WEIGHT if c == category else 0.0), ids))
+            rest.sort(key=lambda group: group[0], reverse=True)
+            for score, ids in rest:
+                if full_and_beats(score):
+                    break
+                for other in ids:
+                    if other not in seen:
+                        seen.add(other)
+                        offer(score, other)
+                        if full_and_beats(score):
+                            break
+
+        ranked = sorted(best, reverse=True)
+        floor = best[0][0] if len(best) >= k else float('-inf')
+        return [(other, books[other][0]) for _, _, other in ranked], floor
+
+    def similar(self, book_id, k=None):
+        """Return up to k (book_id, title) pairs most similar to `book_id`."""
+        k = k or self.k
+        book_id = str(book_id)
+        with self._lock:
+            if book_id not in self._books:
+                return []
+            cached = self._top.get(book_id)
+            if cached is not None and cached[0] >= k:
+                return cached[1][:k]
+            tables = (self._books, self._by_mask, self._by_author, self._by_category)
+            version = self._version
+        results, floor = self._compute(tables, book_id, k)
+        with self._lock:
+            if self._version == version:
+                self._top[book_id] = (k, results, floor)
+        return results
+
+    def metrics(self) -> dict:
+        return {
+            'books': len(self._books),
+            'genre_masks': len(self._by_mask),
+            'cached_results': len(self._top),
+        }
+
+
+if __name__ == '__main__':
+    # Build time, memory and per-book top-k cost for a synthetic catalog: python similar.py [books]
+    import random
+    import sys
+    import time
+    import tracemalloc
+
+    from bson import ObjectId
+
+    GENRES = [f"Genre {i}" for i in range(26)]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    rng = random.Random(42)
+    rows = [{
+        '_id': ObjectId(), 'title': f"Title {i}",
+        'genres': rng.sample(GENRES, rng.randint(2, 6)),
+        'category': rng.choice(('Adult', 'Teens', 'Children')),
+        'authors': [f"Author {rng.randrange(n // 4)}"],
+    } for i in range(n)]
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    index = SimilarityIndex(GENRES)
+    index.build(rows)
+    build_s = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"built {n:,} books in {build_s:.2f}s, peak {peak / 2**20:.0f} MiB, {len(index._by_mask):,} genre masks")
+
+    # The per-book top-k computation a first view pays, and what precomputing all of them would cost
+    sample = [str(r['_id']) for r in rng.sample(rows, 2000)]
+    timings = []
+    for book_id in sample:
+        t0 = time.perf_counter()
+        index.similar(book_id)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    t0 = time.perf_counter()
+    for book_id in sample:
+        index.similar(book_id)
+    warm = (time.perf_counter() - t0) / len(sample)
+    print(f"top-{index.k} per book: p50 {timings[len(timings) // 2] * 1000:.2f} ms, "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1000:.2f} ms, max {timings[-1] * 1000:.2f} ms; "
+          f"{warm * 1e6:.1f} us cached")
+    print(f"precomputing all {n:,} books this way: ~{mean * n:.0f} s on one core")
+
+    # Exactness against brute force on small catalogs, where the distance-limited search often comes up short
+    mismatches = lookups = 0
+    for size in (10, 25, 50, 100, 200):
+        small_rows = rng.sample(rows, size)
+        small = SimilarityIndex(GENRES)
+        small.build(small_rows)
+        for row in small_rows[:40]:
+            book_id = str(row['_id'])
+            got = [small._score(small._books[book_id], small._books[o]) for o, _ in small.similar(book_id)]
+            want = sorted((small._score(small._books[book_id], small._books[o])
+                           for o in small._books if o != book_id), reverse=True)[:small.k]
+            lookups += 1
+            mismatches += got != want
+    print(f"brute force: {lookups - mismatches} of {lookups} top-{index.k} lists match")
+    assert not mismatches
+
+    # Adding books drops only the cached results they enter; the rest must match a fresh lookup
+    for book_id in sample:
+        index.similar(book_id)
+    cached_before = len(index._top)
+    t0 = time.perf_counter()
+    for i in range(100):
+        index.add(ObjectId(), f"New {i}", rng.sample(GENRES, rng.randint(2, 6)),
+                  rng.choice(('Adult', 'Teens', 'Children')), [f"Author {rng.randrange(n // 4)}"])
+    add_ms = (time.perf_counter() - t0) * 1000 / 100
+    kept = dict(index._top)
+    tables = (index._books, index._by_mask, index._by_author, index._by_category)
+    assert all(results == index._compute(tables, book_id, k)[0] for book_id, (k, results, _) in kept.items())
+    print(f"add: {add_ms:.2f} ms each, {cached_before - len(kept)} of {cached_before} cached results dropped")
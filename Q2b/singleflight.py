@@ -0,0 +1,118 @@
+"""Single-flight coalescing for identical concurrent loads.
+
+After a deploy, the catalog pages have no warm cache. Hundreds of requests
+for `/` or `/?category=Adult` then arrive together, and each one would run
+the same title-sorted query. `Group.do(key, fn)` runs `fn` once per key at
+a time. Callers that arrive while it is running wait for that call and get
+the same result object, so results must be treated as read-only. If the
+call raises, every waiter gets the same exception. A waiter that has waited
+`timeout` seconds gives up with FlightTimeout. The call itself keeps running
+for the others.
+
+Nothing is cached: once a call finishes, the next request for the same key
+starts a new one.
+"""
+
+import threading
+
+
+class FlightTimeout(TimeoutError):
+    """Waited too long for another request's identical load to finish."""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key, fn, timeout=None):
+        """Return fn(), sharing one execution among concurrent callers with the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise FlightTimeout(f"Timed out after {timeout}s waiting for {key!r}")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def metrics(self) -> dict:
+        return {'in_flight': len(self._calls), 'executed': self.executed, 'coalesced': self.coalesced,
+                'timeouts': self.timeouts, 'errors': self.errors}
+
+
+if __name__ == '__main__':
+    # N simultaneous identical loads -> one execution: python singleflight.py [clients]
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    group = Group()
+    queries = 0
+    start = threading.Barrier(n)
+
+    def slow_query():
+        global queries
+        queries += 1
+        time.sleep(0.2)  # stand-in for the catalog query
+        return ['book'] * 10
+
+    def request(_):
+        start.wait()
+        return group.do(('list_books', 'Adult'), slow_query, timeout=5)
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        results = list(pool.map(request, range(n)))
+    assert all(r is results[0] for r in results)
+    print(f"{n} simultaneous requests -> {queries} query; {group.metrics()}")
+
+    def failing_query():
+        time.sleep(0.1)
+        raise RuntimeError("connection reset")
+
+    def failing_request(_):
+        start.wait()
+        try:
+            group.do('failing', failing_query, timeout=5)
+        except RuntimeError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        errors = list(pool.map(failing_request, range(n)))
+    print(f"error propagated to {errors.count('connection reset')}/{n} callers")
@@ -0,0 +1,262 @@
+"""Type-ahead suggestions for the catalog filter bar.
+
+Titles and author names are normalized (accents stripped, lower-cased,
+punctuation collapsed) into one sorted array of keys. A prefix lookup is two
+bisects on that array. Matches are ranked by popularity, which is the number
+of loans per book, loaded once from `loans` and bumped as new loans are made.
+
+Short prefixes can match a large share of the catalog, so the top `top_n`
+books are kept precomputed for every prefix of up to `short_prefix`
+characters, and for every longer prefix that matches more than `max_scan`
+keys. This works like a trie that stores top-k only at its heavy nodes. A
+heavy prefix's parent is always heavy too, so the heavy prefixes are found
+by descending from the short ones. The lists are updated in place when a
+book gets a loan or is added. Loans and books that arrive while the index
+is being built are kept and replayed into it once it is ready. Any other
+prefix matches at most `max_scan` keys, and its whole range is ranked
+directly, so results are always ordered by popularity.
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_LEADING_ARTICLE = re.compile(r'^(the|a|an) ')
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return _NON_ALNUM.sub(' ', text).strip()
+
+
+class SuggestIndex:
+    def __init__(self, min_chars=2, short_prefix=3, top_n=20, max_scan=1000):
+        self.min_chars = min_chars
+        self.short_prefix = short_prefix
+        self.top_n = top_n
+        self.max_scan = max_scan
+        self._keys = []        # sorted normalized keys
+        self._ids = []         # book id for each key (parallel to _keys)
+        self._books = {}       # book_id -> (title, authors)
+        self._popularity = {}  # book_id -> loan count
+        self._top = {}         # short or heavy prefix -> [book_id, ...] most popular first
+        self._pending = None   # adds and bumps made while a build runs, replayed into its tables
+        self._lock = threading.Lock()
+        self.built = False
+
+    @staticmethod
+    def _keys_for(title, authors):
+        keys = set()
+        norm_title = normalize(title)
+        if norm_title:
+            keys.add(norm_title)
+            keys.add(_LEADING_ARTICLE.sub('', norm_title))  # "the door of no return" -> "door of ..."
+        for author in authors or ():
+            norm_author = normalize(author)
+            if norm_author:
+                keys.add(norm_author)
+        return keys
+
+    def start_build(self):
+        """Start keeping add() and bump() calls for the next build() to replay.
+
+        Call it before reading the loan counts for build(), so no loan falls
+        between those counts and the new tables. (A loan made at that very
+        moment may be counted twice, which only nudges its ranking.)
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+
+    def cancel_build(self):
+        """Stop keeping calls after a failed build; the next one reads them from the database."""
+        with self._lock:
+            self._pending = None
+
+    def build(self, books, loan_counts):
+        """`books`: raw dicts with _id/title/authors; `loan_counts`: {book_id: count}."""
+        self.start_build()
+        try:
+            pairs, meta = [], {}
+            for row in books:
+                book_id = str(row['_id'])
+                meta[book_id] = (row.get('title'), tuple(row.get('authors') or ()))
+                pairs.extend((key, book_id) for key in self._keys_for(row.get('title'), row.get('authors')))
+            pairs.sort()
+            keys = [k for k, _ in pairs]
+            ids = [i for _, i in pairs]
+            popularity = {str(k): v for k, v in loan_counts.items()}
+            rank = lambda i: (popularity.get(i, 0), meta[i][0] or '')
+            top = self._precompute(keys, ids, rank)
+        except BaseException:
+            self.cancel_build()
+            raise
+        with self._lock:
+            self._keys = keys
+            self._ids = ids
+            self._books = meta
+            self._popularity = popularity
+            self._top = top
+            self.built = True
+            for replay, args in self._pending:
+                replay(*args)
+            self._pending = None
+
+    def _precompute(self, keys, ids, rank):
+        """Top lists for every short prefix and every heavy longer one, one level at a time."""
+        top, parents, n = {}, [(0, len(keys))], 0
+        while parents:
+            n += 1
+            children = []
+            for lo, hi in parents:
+                i = lo
+                while i < hi:
+                    if len(keys[i]) < n:  # the parent prefix itself, sorted first
+                        i += 1
+                        continue
+                    prefix = keys[i][:n]
+                    j = bisect_left(keys, prefix + '\x7f', i, hi)
+                    heavy = j - i > self.max_scan
+                    if n >= self.min_chars and (n <= self.short_prefix or heavy):
+                        top[prefix] = heapq.nlargest(self.top_n, set(ids[i:j]), key=rank)
+                    if heavy or n < self.short_prefix:
+                        children.append((i, j))
+                    i = j
+            parents = children
+        return top
+
+    def _range(self, prefix):
+        lo = bisect_left(self._keys, prefix)
+        return lo, bisect_left(self._keys, prefix + '\x7f', lo)  # keys contain only [0-9a-z ]
+
+    def _top_prefixes(self, key):
+        # Short prefixes, then longer ones while they are heavy
+        prefixes = {key[:n] for n in range(self.min_chars, min(self.short_prefix, len(key)) + 1)}
+        n = self.short_prefix + 1
+        while n <= len(key) and key[:n] in self._top:
+            prefixes.add(key[:n])
+            n += 1
+        return prefixes
+
+    def _rank(self, book_id):
+        return (self._popularity.get(book_id, 0), self._books[book_id][0] or '')
+
+    def _promote(self, book_id):
+        # Caller holds the lock. Re-rank book_id in every precomputed list it belongs to.
+        title, authors = self._books[book_id]
+        prefixes = set()
+        for key in self._keys_for(title, authors):
+            prefixes |= self._top_prefixes(key)
+        for prefix in prefixes:
+            top = self._top.setdefault(prefix, [])
+            if book_id not in top:
+                top.append(book_id)
+            top.sort(key=self._rank, reverse=True)
+            del top[self.top_n:]
+
+    def add(self, book_id, title, authors):
+        book_id = str(book_id)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._add, (book_id, title, authors)))
+            if self.built:
+                self._add(book_id, title, authors)
+
+    def _add(self, book_id, title, authors):
+        # Caller holds the lock
+        if book_id in self._books:
+            return  # a replayed add the build already read
+        self._books[book_id] = (title, tuple(authors or ()))
+        keys = self._keys_for(title, authors)
+        for key in keys:
+            pos = bisect_left(self._keys, key)
+            self._keys.insert(pos, key)
+            self._ids.insert(pos, book_id)
+        # A longer prefix may have just become heavy
+        for key in keys:
+            for n in range(self.short_prefix + 1, len(key) + 1):
+                prefix = key[:n]
+                if prefix not in self._top:
+                    lo, hi = self._range(prefix)
+                    if hi - lo <= self.max_scan:
+                        break
+                    self._top[prefix] = heapq.nlargest(self.top_n, set(self._ids[lo:hi]), key=self._rank)
+        self._promote(book_id)
+
+    def bump(self, book_id, by=1):
+        """Record a new loan for ranking purposes."""
+        book_id = str(book_id)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._bump, (book_id, by)))
+            self._bump(book_id, by)
+
+    def _bump(self, book_id, by):
+        # Caller holds the lock
+        self._popularity[book_id] = self._popularity.get(book_id, 0) + by
+        if book_id in self._books:
+            self._promote(book_id)
+
+    def lookup(self, query: str, limit=8):
+        """Return up to `limit` dicts {id, title, authors}, most borrowed first."""
+        prefix = normalize(query)
+        if len(prefix) < self.min_chars:
+            return []
+        with self._lock:
+            ranked = self._top.get(prefix) if limit <= self.top_n else None
+            if ranked is not None:
+                ranked = ranked[:limit]
+            else:
+                # At most max_scan keys unless limit is above top_n
+                lo, hi = self._range(prefix)
+                ranked = heapq.nlargest(limit, set(self._ids[lo:hi]), key=self._rank)
+            return [{'id': i, 'title': self._books[i][0], 'authors': list(self._books[i][1])} for i in ranked]
+
+    def metrics(self) -> dict:
+        short = sum(1 for prefix in self._top if len(prefix) <= self.short_prefix)
+        return {'keys': len(self._keys), 'books': len(self._books), 'short_prefixes': short,
+                'heavy_prefixes': len(self._top) - short}
+
+
+if __name__ == '__main__':
+    # Lookup latency: python suggest.py [books]
+    import random
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rng = random.Random(7)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+    books = [{'_id': i, 'title': ' '.join(rng.sample(words, rng.randint(1, 5))).title(),
+              'authors': [f"{rng.choice(words).title()} {rng.choice(words).title()}"]} for i in range(n)]
+    index = SuggestIndex()
+    t0 = time.perf_counter()
+    index.build(books, {i: rng.randint(0, 50) for i in range(n)})
+    print(f"built {n:,} books / {len(index._keys):,} keys in {time.perf_counter() - t0:.2f}s")
+    queries = [b['title'][:rng.randint(2, 8)] for b in rng.sample(books, 20_000)]
+    timings = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.lookup(q)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    pct = lambda p: timings[int(len(timings) * p) - 1] * 1e6
+    print(f"lookup p50 {pct(0.50):.0f} us, p99 {pct(0.99):.0f} us, max {timings[-1] * 1e6:.0f} us")
+
+    # Rankings must match a brute-force ranking, including prefixes that match over max_scan keys
+    index = SuggestIndex(max_scan=50)  # small enough that many 4+ character prefixes are heavy
+    index.build(books, {i: rng.randint(0, 50) for i in range(n)})
+    for b in rng.sample(books, 200):
+        index.bump(b['_id'], rng.randint(1, 100))
+    for i in range(n, n + 200):
+        index.add(i, f"The {rng.choice(words).title()} Saga", ["Ann Author"])
+    for q in [b['title'][:rng.randint(2, 8)] for b in rng.sample(books, 300)] + ['the', 'the ', 'ann', 'ann a']:
+        prefix = normalize(q)
+        lo, hi = index._range(prefix)
+        expected = heapq.nlargest(8, set(index._ids[lo:hi]), key=index._rank)
+        assert [r['id'] for r in index.lookup(q)] == expected, q
+    print(f"rankings match brute force; {index.metrics()}")
@@ -0,0 +1,65 @@
+"""Shared fixtures.
+
+The app is imported once per session against mongomock, so the tests need
+no running mongod, never touch the real `ict_239_library` database and
+never download covers. Run from Q2b/: python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import flask_mongoengine
+    import mongomock
+
+    original = flask_mongoengine.MongoEngine.init_app
+
+    def init_app(self, app, config=None):
+        app.config['MONGODB_SETTINGS']['mongo_client_class'] = mongomock.MongoClient
+        app.config['COVER_PREFETCH_ON_START'] = False
+        return original(self, app, config)
+
+    flask_mongoengine.MongoEngine.init_app = init_app
+    try:
+        import app
+    finally:
+        flask_mongoengine.MongoEngine.init_app = original
+    app.app.config['TESTING'] = True
+    return app
+
+
+class DatabaseCalls:
+    """Collection calls made against mongomock, counted per thread."""
+
+    METHODS = ('find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many', 'delete_one',
+               'delete_many', 'aggregate', 'count_documents', 'find_one_and_update', 'bulk_write')
+
+    def __init__(self):
+        self.per_thread = Counter()
+
+    def mine(self) -> int:
+        return self.per_thread[threading.get_ident()]
+
+
+@pytest.fixture
+def db_calls(monkeypatch):
+    import mongomock
+
+    calls = DatabaseCalls()
+    for name in DatabaseCalls.METHODS:
+        method = getattr(mongomock.collection.Collection, name)
+
+        def counted(self, *args, _method=method, **kwargs):
+            calls.per_thread[threading.get_ident()] += 1
+            return _method(self, *args, **kwargs)
+
+        monkeypatch.setattr(mongomock.collection.Collection, name, counted)
+    return calls
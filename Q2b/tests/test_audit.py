@@ -0,0 +1,186 @@
+import threading
+import time
+
+from bson import ObjectId
+from mongoengine.connection import get_db
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from audit import DUPLICATE_KEY, AuditLog, audit
+from model import Book, User
+
+
+class Sink:
+    """Stand-in for insert_many: records each call, optionally slow or failing."""
+
+    def __init__(self, delay=0.0, errors=()):
+        self.delay = delay
+        self.errors = list(errors)  # raised by successive calls, then calls succeed
+        self.calls = []
+        self.stored = []
+
+    def __call__(self, docs):
+        self.calls.append([doc['n'] for doc in docs])
+        time.sleep(self.delay)
+        if self.errors:
+            error = self.errors.pop(0)
+            if callable(error):
+                error = error(docs)
+            raise error
+        self.stored.extend(doc['n'] for doc in docs)
+
+
+def make_log(sink, **options):
+    options.setdefault('flush_interval', 0.05)
+    options.setdefault('retry_backoff', 0.001)
+    log = AuditLog(**options)
+    log.configure(sink=sink)
+    return log
+
+
+def test_record_does_not_wait_for_a_slow_sink_and_batches_writes():
+    sink = Sink(delay=0.02)  # a 20 ms round trip per insert_many
+    log = make_log(sink, batch_size=100)
+    t0 = time.perf_counter()
+    for n in range(500):
+        assert log.record('loan.create', n=n)
+    per_event = (time.perf_counter() - t0) / 500
+    assert per_event < 0.002  # an inline insert would cost 20 ms each
+    assert log.flush()
+    assert sorted(sink.stored) == list(range(500))
+    assert len(sink.calls) <= 10 and max(map(len, sink.calls)) <= 100
+    assert log.metrics()['written'] == 500
+    log.close()
+
+
+def test_unconfigured_log_records_nothing():
+    log = AuditLog()
+    assert not log.record('loan.create', n=1)
+    assert log.metrics()['enqueued'] == 0
+
+
+def test_failed_batch_is_retried_until_it_succeeds():
+    sink = Sink(errors=[AutoReconnect('primary stepped down'), AutoReconnect('still electing')])
+    log = make_log(sink)
+    for n in range(3):
+        log.record('loan.create', n=n)
+    assert log.flush()
+    assert sink.calls == [[0, 1, 2]] * 3
+    assert sink.stored == [0, 1, 2]
+    metrics = log.metrics()
+    assert (metrics['written'], metrics['retried'], metrics['failed']) == (3, 6, 0)
+    log.close()
+
+
+def test_bulk_write_error_retries_only_unwritten_docs_and_counts_duplicates_as_written():
+    def partial(docs):
+        # docs 1 and 3 failed: 1 transiently, 3 because an earlier attempt had stored it
+        return BulkWriteError({'writeErrors': [{'index': 1, 'code': 91, 'errmsg': 'shutting down'},
+                                               {'index': 3, 'code': DUPLICATE_KEY, 'errmsg': 'duplicate'}]})
+
+    sink = Sink(errors=[partial])
+    log = make_log(sink)
+    for n in range(4):
+        log.record('loan.create', n=n)
+    assert log.flush()
+    assert sink.calls == [[0, 1, 2, 3], [1]]
+    metrics = log.metrics()
+    assert (metrics['written'], metrics['retried'], metrics['failed']) == (4, 1, 0)
+    log.close()
+
+
+def test_events_still_failing_after_the_last_retry_count_as_failed():
+    sink = Sink(errors=[AutoReconnect('down')] * 10)
+    log = make_log(sink, retries=2)
+    log.record('loan.create', n=0)
+    log.record('loan.create', n=1)
+    assert log.flush()
+    assert len(sink.calls) == 3
+    metrics = log.metrics()
+    assert (metrics['written'], metrics['failed']) == (0, 2)
+    assert metrics['last_error'] == 'AutoReconnect: down'
+    log.close()
+
+
+class BlockedSink(Sink):
+    """Holds the writer inside its first write until released, so the queue can fill."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, docs):
+        self.entered.set()
+        self.release.wait(5)
+        super().__call__(docs)
+
+
+def fill(log, sink, size):
+    log.record('loan.create', n=-1)  # taken by the writer, which then blocks in the sink
+    assert sink.entered.wait(5)
+    for n in range(size):
+        assert log.record('loan.create', n=n)
+
+
+def test_drop_new_keeps_the_queued_events():
+    sink = BlockedSink()
+    log = make_log(sink, max_queue=3, batch_size=10, overflow='drop_new')
+    fill(log, sink, 3)
+    assert not log.record('loan.create', n=3)
+    sink.release.set()
+    assert log.flush()
+    assert sink.stored == [-1, 0, 1, 2]
+    assert log.metrics()['dropped'] == 1
+    log.close()
+
+
+def test_drop_oldest_makes_room_for_the_new_event():
+    sink = BlockedSink()
+    log = make_log(sink, max_queue=3, batch_size=10, overflow='drop_oldest')
+    fill(log, sink, 3)
+    assert log.record('loan.create', n=3)
+    sink.release.set()
+    assert log.flush()
+    assert sink.stored == [-1, 1, 2, 3]
+    assert log.metrics()['dropped'] == 1
+    log.close()
+
+
+def test_block_waits_at_most_block_timeout_then_drops():
+    sink = BlockedSink()
+    log = make_log(sink, max_queue=3, batch_size=10, overflow='block', block_timeout=0.05)
+    fill(log, sink, 3)
+    t0 = time.perf_counter()
+    assert not log.record('loan.create', n=3)
+    assert 0.04 <= time.perf_counter() - t0 < 1.0
+    sink.release.set()
+    assert log.flush()
+    assert log.record('loan.create', n=4)  # room again once the writer drained the queue
+    assert log.flush()
+    assert sink.stored == [-1, 0, 1, 2, 4]
+    assert log.metrics()['dropped'] == 1
+    log.close()
+
+
+def test_close_writes_what_is_queued_and_refuses_new_events():
+    sink = Sink()
+    log = make_log(sink, batch_size=100, flush_interval=10)
+    for n in range(5):
+        log.record('loan.create', n=n)
+    log.close()
+    assert sink.stored == [0, 1, 2, 3, 4]
+    assert not log.record('loan.create', n=5)
+
+
+def test_loan_through_the_app_is_audited_off_the_request_path(app_module):
+    user = User(username=f'audit-{ObjectId()}', email=f'{ObjectId()}@example.com', name='Audit',
+                password_hash='x').save()
+    book = Book(title='Audited', authors=['A. Uthor'], available=1, copies=1).save()
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(user.id)
+    assert client.post(f'/loan/create/{book.id}').status_code == 302
+    assert audit.flush()
+    events = list(get_db()['audit_log'].find({'book': book.id}))
+    assert [event['action'] for event in events] == ['loan.create']
+    assert events[0]['member'] == user.id
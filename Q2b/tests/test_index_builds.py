@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+from bson import ObjectId
+
+from similar import SimilarityIndex
+from suggest import SuggestIndex
+
+
+class PausedRows:
+    """A query that stops after its first row until released, as a slow catalog read would."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def __iter__(self):
+        for i, row in enumerate(self.rows):
+            if i == 1:
+                self.reading.set()
+                assert self.release.wait(5)
+            yield row
+
+
+def row(title, genres, category='Adult', authors=('A. Uthor',)):
+    return {'_id': ObjectId(), 'title': title, 'genres': list(genres), 'category': category, 'authors': list(authors)}
+
+
+def test_similar_index_keeps_books_added_while_it_builds():
+    index = SimilarityIndex(['Fantasy', 'Magic', 'Poetry'], k=2)
+    first = row('First', ['Fantasy', 'Magic'])
+    rows = PausedRows([first, row('Second', ['Poetry'], authors=['B'])])
+    thread = threading.Thread(target=index.build, args=(rows,))
+    thread.start()
+    assert rows.reading.wait(5)
+    added = ObjectId()
+    index.add(added, 'Added', ['Fantasy', 'Magic'], 'Adult', ['C'])
+    assert not index.built
+    rows.release.set()
+    thread.join(5)
+    assert index.built
+    assert index.similar(first['_id'])[0] == (str(added), 'Added')
+    assert index.metrics()['books'] == 3
+
+
+def test_similar_index_ignores_a_replayed_add_the_build_already_read():
+    index = SimilarityIndex(['Fantasy'], k=2)
+    book = row('Both', ['Fantasy'])
+    rows = PausedRows([row('Other', ['Fantasy']), book])
+    thread = threading.Thread(target=index.build, args=(rows,))
+    thread.start()
+    assert rows.reading.wait(5)
+    index.add(book['_id'], book['title'], book['genres'], book['category'], book['authors'])
+    rows.release.set()
+    thread.join(5)
+    assert index.metrics()['books'] == 2
+
+
+def test_suggest_index_keeps_books_and_loans_added_while_it_builds():
+    index = SuggestIndex(min_chars=2)
+    quiet, popular = row('Dragon Tales', []), row('Dragon Songs', [])
+    rows = PausedRows([quiet, popular])
+    index.start_build()  # as app.py does before reading the loan counts
+    thread = threading.Thread(target=index.build, args=(rows, {quiet['_id']: 1}))
+    thread.start()
+    assert rows.reading.wait(5)
+    added = ObjectId()
+    index.add(added, 'Dragon Atlas', ['C. Artographer'])
+    for _ in range(2):
+        index.bump(popular['_id'])
+    rows.release.set()
+    thread.join(5)
+    assert [hit['title'] for hit in index.lookup('dra')] == ['Dragon Songs', 'Dragon Tales', 'Dragon Atlas']
+    assert [hit['title'] for hit in index.lookup('dragon a')] == ['Dragon Atlas']
+    assert index.metrics()['books'] == 3
+
+
+def test_suggest_index_stops_keeping_calls_after_a_failed_build():
+    index = SuggestIndex()
+
+    def failing_rows():
+        raise RuntimeError('connection reset')
+        yield
+
+    with pytest.raises(RuntimeError):
+        index.build(failing_rows(), {})
+    index.bump(ObjectId())
+    assert index._pending is None and not index.built
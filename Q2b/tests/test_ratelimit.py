@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+from ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_capacity_then_refills():
+    clock = FakeClock()
+    limiter = RateLimiter({'create_loan': (3, 0.5)}, clock=clock)
+    assert [limiter.hit('create_loan', 'u1') for _ in range(3)] == [0, 0, 0]
+    assert limiter.hit('create_loan', 'u1') == 2.0  # one token every 2s
+    assert limiter.hit('create_loan', 'u2') == 0    # buckets are per client
+    clock.now = 2.0
+    assert limiter.hit('create_loan', 'u1') == 0
+    assert limiter.metrics()['rejected'] == {'create_loan': 1}
+
+
+def test_concurrent_burst_passes_exactly_capacity_and_429s_never_touch_the_database(app_module, db_calls):
+    capacity, _ = app_module.rate_limiter.rules['create_loan']
+    n = 40
+    user_id, book_id = str(ObjectId()), str(ObjectId())
+    start = threading.Barrier(n)
+
+    def request(_):
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        start.wait()
+        before = db_calls.mine()
+        status = client.post(f'/loan/create/{book_id}').status_code
+        return status, db_calls.mine() - before
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        results = list(pool.map(request, range(n)))
+    passed = [calls for status, calls in results if status != 429]
+    rejected = [calls for status, calls in results if status == 429]
+    assert len(passed) == capacity
+    assert len(rejected) == n - capacity
+    assert sum(rejected) == 0
+    assert all(passed)  # the admitted requests did reach the database
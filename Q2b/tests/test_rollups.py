@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from mongoengine.connection import get_db
+
+import rollups
+from model import Book, Loan, User
+
+
+@pytest.fixture
+def member(app_module):
+    return User(username=f'rollups-{ObjectId()}', email=f'{ObjectId()}@example.com', name='Rollups',
+                password_hash='x').save()
+
+
+def new_book(category='Adult', genres=('Fantasy',)):
+    return Book(title=f'Rolled {ObjectId()}', authors=['A. Uthor'], category=category, genres=list(genres),
+                available=5, copies=5).save()
+
+
+def day_doc(loan):
+    return get_db()[rollups.DAILY].find_one({'_id': rollups.day_of(loan.created_at)})
+
+
+def rebuild():
+    return rollups.rebuild_rollups(Loan._get_collection(), Book._get_collection(), resume=False)
+
+
+def test_deleting_a_returned_loan_keeps_it_in_the_rollups(member):
+    book = new_book()
+    loan, created, msg = Loan.create_loan(member, book)
+    assert created, msg
+    before = day_doc(loan)
+    assert before['books'][str(book.id)]['loans'] == 1
+    assert loan.return_book()[0]
+    assert loan.delete_if_allowed()[0]
+    assert day_doc(loan) == before
+    rebuild()
+    assert day_doc(loan) == before  # the remaining loans show fewer; the day document wins
+
+
+def test_counts_stay_under_the_category_and_genres_at_loan_time(member):
+    book = new_book(category='Teens', genres=('Poetry',))
+    loan, created, msg = Loan.create_loan(member, book)
+    assert created, msg
+    before = day_doc(loan)
+    book.category, book.genres = 'Adult', ['Grief']
+    book.save()
+    assert loan.return_book()[0]
+    assert loan.delete_if_allowed()[0]
+    rebuild()
+    after = day_doc(loan)
+    assert after['category'] == before['category'] and after['genre'] == before['genre']
+
+
+def test_rebuild_adds_loans_the_rollups_never_counted(member):
+    book = new_book(category='Children', genres=('Animals', 'Picture Books'))
+    borrowed = datetime.utcnow().replace(microsecond=0) - timedelta(days=400)
+    legacy = Loan(member=member, book=book, borrow_date=borrowed, due_date=borrowed + timedelta(days=14),
+                  renew_count=1).save()
+    assert legacy.created_at is None
+    day = rollups.day_of(borrowed)
+    daily = get_db()[rollups.DAILY]
+    assert daily.find_one({'_id': day}) is None
+    assert rebuild() >= 1
+    doc = daily.find_one({'_id': day})
+    assert doc['books'][str(book.id)] == {'title': book.title, 'loans': 1, 'renewals': 1}
+    assert doc['category']['Children'] == 1 and doc['genre']['Picture Books'] == 1
+    assert rebuild() == 0  # nothing missing the second time
+    assert daily.find_one({'_id': day}) == doc
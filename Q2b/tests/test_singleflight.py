@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import FlightTimeout, Group
+
+
+def run_together(n, fn):
+    start = threading.Barrier(n)
+
+    def call(i):
+        start.wait()
+        return fn(i)
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(call, range(n)))
+
+
+def test_simultaneous_identical_loads_run_once_and_share_the_result():
+    group = Group()
+    executions = []
+
+    def slow_query():
+        executions.append(1)
+        time.sleep(0.2)
+        return ['book'] * 10
+
+    results = run_together(50, lambda _: group.do(('list_books', 'Adult'), slow_query, timeout=5))
+    assert len(executions) == 1
+    assert all(r is results[0] for r in results)
+    assert group.metrics() == {'in_flight': 0, 'executed': 1, 'coalesced': 49, 'timeouts': 0, 'errors': 0}
+    group.do(('list_books', 'Adult'), slow_query, timeout=5)
+    assert len(executions) == 2  # nothing is cached once the call finished
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    group = Group()
+    results = run_together(4, lambda i: group.do(i % 2, lambda: (time.sleep(0.1), i % 2)[1], timeout=5))
+    assert sorted(results) == [0, 0, 1, 1]
+    assert group.metrics()['executed'] == 2
+
+
+def test_an_error_reaches_every_waiter():
+    group = Group()
+
+    def failing_query():
+        time.sleep(0.1)
+        raise RuntimeError('connection reset')
+
+    def request(_):
+        try:
+            group.do('failing', failing_query, timeout=5)
+        except RuntimeError as e:
+            return str(e)
+
+    assert run_together(20, request) == ['connection reset'] * 20
+    assert group.metrics()['errors'] == 1
+
+
+def test_a_waiter_gives_up_but_the_call_finishes_for_the_leader():
+    group = Group()
+    started = threading.Event()
+
+    def slow_query():
+        started.set()
+        time.sleep(0.3)
+        return 'rows'
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(group.do, 'slow', slow_query, 5)
+        assert started.wait(5)
+        with pytest.raises(FlightTimeout):
+            group.do('slow', slow_query, timeout=0.05)
+        assert leader.result() == 'rows'
+    assert group.metrics()['timeouts'] == 1
+
+
+def test_catalog_stampede_runs_one_query_and_sheds_waiters_with_503(app_module, monkeypatch):
+    calls = []
+
+    def slow_list_books(category, read_preference=None):
+        calls.append(category)
+        time.sleep(0.5)
+        return []
+
+    monkeypatch.setattr(app_module, 'catalog_replica', None)
+    monkeypatch.setattr(app_module.views, 'list_books', slow_list_books)
+    monkeypatch.setitem(app_module.app.config, 'SINGLE_FLIGHT_TIMEOUT', 0.1)
+
+    def request(_):
+        response = app_module.app.test_client().get('/?category=Stampede')
+        return response.status_code, response.headers.get('Retry-After')
+
+    results = run_together(10, request)
+    assert calls == ['Stampede']
+    assert results.count((200, None)) == 1
+    assert results.count((503, '5')) == 9
@@ -0,0 +1,137 @@
+"""Read-only fast path for list pages.
+
+Turning every row of a large catalog or loan history into a MongoEngine
+Document (field descriptors, change tracking, clean() plumbing) costs far more
+CPU than the query itself. The views here are built straight from the raw
+documents returned by `as_pymongo()` / `aggregate()` into small `__slots__`
+objects that expose the attributes and helpers the templates use.
+
+They are read-only: anything that changes a book or loan still loads the real
+Document from model.py.
+"""
+
+from datetime import datetime
+
+from model import Book, Loan, summarize_description
+
+# Fields the catalog list needs; the compressed full description is never fetched
+BOOK_LIST_FIELDS = ('title', 'authors', 'genres', 'category', 'url', 'pages',
+                    'available', 'copies', 'summary', 'description', 'updated_at', 'card_version')
+
+
+class BookView:
+    __slots__ = ('id', 'title', 'authors', 'genres', 'category', 'url', 'pages',
+                 'available', 'copies', 'summary', 'description', 'updated_at', 'card_version')
+
+    def __init__(self, son: dict):
+        self.id = son.get('_id')
+        self.title = son.get('title')
+        self.authors = son.get('authors') or []
+        self.genres = son.get('genres') or []
+        self.category = son.get('category')
+        self.url = son.get('url')
+        self.pages = son.get('pages')
+        self.available = son.get('available')
+        self.copies = son.get('copies')
+        self.summary = son.get('summary') or []
+        self.description = son.get('description') or []  # only set on books not yet compressed
+        self.updated_at = son.get('updated_at')
+        self.card_version = son.get('card_version') or 0
+
+    # Same helpers as model.Book
+    @property
+    def card_description(self) -> list:
+        return self.summary or summarize_description(self.description)
+
+    @property
+    def first_paragraph(self) -> str:
+        paragraphs = self.card_description
+        return paragraphs[0] if paragraphs else ""
+
+    def can_borrow(self) -> bool:
+        return (self.available or 0) > 0
+
+    def can_return(self) -> bool:
+        if self.copies is None:
+            return False
+        return (self.available or 0) < self.copies
+
+
+class LoanView:
+    __slots__ = ('id', 'book', 'borrow_date', 'due_date', 'return_date', 'renew_count')
+
+    def __init__(self, son: dict, book: BookView):
+        self.id = son.get('_id')
+        self.book = book
+        self.borrow_date = son.get('borrow_date')
+        self.due_date = son.get('due_date')
+        self.return_date = son.get('return_date')
+        self.renew_count = son.get('renew_count') or 0
+
+    # Same rules as model.Loan
+    @property
+    def is_returned(self) -> bool:
+        return self.return_date is not None
+
+    @property
+    def is_overdue(self) -> bool:
+        return (not self.is_returned) and datetime.utcnow() > self.due_date
+
+    @property
+    def can_renew(self) -> bool:
+        return (not self.is_returned) and (not self.is_overdue) and self.renew_count < Loan.MAX_RENEWS
+
+    @property
+    def can_return(self) -> bool:
+        return not self.is_returned
+
+    @property
+    def can_delete(self) -> bool:
+        return self.is_returned
+
+
+def list_books(category=None, read_preference=None):
+    """Title-sorted BookViews, optionally filtered by category."""
+    filters = {'category': category} if category else {}
+    qs = Book.objects(**filters)
+    if read_preference is not None:
+        qs = qs.read_preference(read_preference)
+    rows = qs.only(*BOOK_LIST_FIELDS).order_by('title').as_pymongo()
+    return [BookView(son) for son in rows]
+
+
+def loans_for_user(user, read_preference=None):
+    """A member's loans, newest first, with each book joined in the same query."""
+    book_fields = {f: 1 for f in BOOK_LIST_FIELDS}
+    pipeline = [
+        {'$match': {'member': user.id}},
+        {'$sort': {'borrow_date': -1}},
+        {'$lookup': {'from': Book._get_collection_name(), 'localField': 'book',
+                     'foreignField': '_id', 'as': 'book_doc'}},
+        {'$unwind': '$book_doc'},
+        {'$project': {'borrow_date': 1, 'due_date': 1, 'return_date': 1, 'renew_count': 1,
+                      'book_doc._id': 1, **{f'book_doc.{f}': v for f, v in book_fields.items()}}},
+    ]
+    loans = Loan._get_collection()
+    if read_preference is not None:
+        loans = loans.with_options(read_preference=read_preference)
+    return [LoanView(son, BookView(son['book_doc'])) for son in loans.aggregate(pipeline)]
+
+
+if __name__ == '__main__':
+    # Documents/sec: raw views vs full MongoEngine hydration (no database needed)
+    import time
+    from bson import ObjectId
+
+    now = datetime.utcnow()
+    sons = [{
+        '_id': ObjectId(), 'title': f"Title {i}", 'authors': ['Jane Doe', 'John Smith'],
+        'genres': ['Fiction', 'Fantasy', 'Romance'], 'category': 'Adult', 'url': 'https://example.com/c.jpg',
+        'pages': 300, 'available': 1, 'copies': 2, 'summary': ['First. ' * 30, 'Last. ' * 30], 'updated_at': now,
+    } for i in range(50_000)]
+    for label, build in (('Book._from_son', Book._from_son), ('BookView', BookView)):
+        t0 = time.perf_counter()
+        for son in sons:
+            build(son)
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<16} {len(sons) / elapsed:>12,.0f} docs/s")